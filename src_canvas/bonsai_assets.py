@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Author: Viktor Pfaffenrot
+
+
+Cache of the decoded and resized images of the GUI. Each image is rendered
+once for a given source file, modification time, target size and scaling
+factor and stored as a lightly compressed PNG, which ``tk.PhotoImage`` reads
+without PIL. Later launches skip the decode and resampling of the source
+file. The cache directory is bounded in size; the least recently used files
+are removed first.
+"""
+
+from bonsai_profiling import startup_profile
+import tkinter as tk
+import hashlib
+import time
+import os
+
+
+def default_cache_dir():
+    r"""
+    :return: ``$XDG_CACHE_HOME/bonsai_notifier/images``, by default below
+        ``~/.cache``.
+    """
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(base, "bonsai_notifier", "images")
+
+
+class asset_cache:
+    r"""
+    Loads images of an exact pixel size as ``tk.PhotoImage``, or decoded for
+    ``ctk.CTkImage`` by :meth:`load_decoded`. Images are kept in memory for
+    the running app and on disk for later launches. The time spent per image
+    is added to ``profile`` as ``image <name>`` together with whether the
+    disk cache was hit.
+
+    .. automethod:: load
+    .. automethod:: load_decoded
+    """
+
+    def __init__(
+        self,
+        cache_dir: str = None,
+        max_bytes: int = 4 * 1024 * 1024,
+        profile: object = None,
+    ):
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.max_bytes = max_bytes
+        self.profile = profile or startup_profile(enabled=False)
+        self.images = {}  #: in-memory images of this session
+
+    def key(self, path: str, size: tuple, scaling: float = 1.0):
+        r"""
+        :return: file name of the cached rendering.
+        """
+        path = os.path.abspath(path)
+        stamp = f"{path}|{os.stat(path).st_mtime_ns}|{size[0]}x{size[1]}"
+        digest = hashlib.sha1(f"{stamp}|{scaling:g}".encode()).hexdigest()
+        return f"{digest[:20]}.png"
+
+    def load(self, master: object, path: str, size: tuple, scaling=1.0):
+        r"""
+        Returns ``path`` resized to ``size`` times ``scaling`` pixels.
+
+        :return: tk.PhotoImage
+        """
+        key = self.key(path, size, scaling)
+        if key in self.images:
+            return self.images[key]
+
+        start = time.perf_counter()
+        cached, hit = self._cached(path, size, scaling, key)
+        image = tk.PhotoImage(master=master, file=cached)
+        self.images[key] = image
+        self._add_profile(path, hit, start)
+        return image
+
+    def load_decoded(self, path: str, size: tuple, scaling=1.0):
+        r"""
+        Returns ``path`` resized to ``size`` times ``scaling`` pixels as a PIL
+        image, e.g. for ``ctk.CTkImage``, which rescales it itself when the
+        scaling changes.
+
+        :return: PIL.Image.Image
+        """
+        from PIL import Image
+
+        key = self.key(path, size, scaling)
+        if ("decoded", key) in self.images:
+            return self.images[("decoded", key)]
+
+        start = time.perf_counter()
+        cached, hit = self._cached(path, size, scaling, key)
+        with Image.open(cached) as image:
+            image.load()
+        self.images[("decoded", key)] = image
+        self._add_profile(path, hit, start)
+        return image
+
+    def _cached(self, path: str, size: tuple, scaling: float, key: str):
+        r"""
+        Renders ``path`` into the disk cache unless it is there already.
+
+        :return: Tuple of the path of the cached file and whether it was hit.
+        """
+        cached = os.path.join(self.cache_dir, key)
+        hit = os.path.isfile(cached)
+        if hit:
+            os.utime(cached)
+        else:
+            self._render(path, size, scaling, cached)
+        return cached, hit
+
+    def _add_profile(self, path: str, hit: bool, start: float):
+        name = os.path.basename(path)
+        self.profile.add(
+            f"image {name} ({'hit' if hit else 'miss'})",
+            time.perf_counter() - start,
+        )
+
+    def _render(self, path: str, size: tuple, scaling: float, cached: str):
+        r"""
+        Decodes and resamples the source with PIL, which is only needed on a
+        cache miss, and stores the result atomically. The GUI has it loaded
+        anyway, since customtkinter imports it.
+        """
+        from PIL import Image
+
+        pixels = (round(size[0] * scaling), round(size[1] * scaling))
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp = f"{cached}.{os.getpid()}.tmp"
+        with Image.open(path) as source:
+            source.convert("RGBA").resize(pixels).save(
+                tmp, format="PNG", compress_level=1
+            )
+        os.replace(tmp, cached)
+        self.prune(keep=cached)
+
+    def prune(self, keep: str = None):
+        r"""
+        Removes the least recently used files until the cache fits into
+        ``max_bytes``. The file ``keep`` is never removed.
+
+        :return: number of bytes removed.
+        """
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.path == keep:
+                continue
+            if entry.is_file() and entry.name.endswith(".png"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        if keep is not None:
+            total += os.path.getsize(keep)
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total - removed <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            removed += size
+        return removed
@@ -0,0 +1,672 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Author: Viktor Pfaffenrot
+
+
+Headless benchmarks of the app. The navigation benchmark drives
+``bonsai_notifier.next_bonsai`` and ``prev_bonsai`` on collections of
+different size. The canvas and the entry fields are replaced by stand-ins
+with the same methods, so no display is needed and only the work done by the
+app itself is measured. Besides the time per click, the memory allocated
+while clicking is traced; it must not grow with the collection size. The
+search benchmark types tree names letter by letter into
+``tree_collection.search``.
+
+The database benchmark runs on synthetic databases built by
+:func:`generate_database` with a given number of trees, saved versions per
+tree and bytes of care notes per tree. It times ``initialize_table``, the
+loads of ``bonsai_database`` and ``bonsai``, adding and removing a tree,
+saving a change set and loading and saving care notes. ``--json`` writes all
+results with the commit they were measured on; ``--compare`` reports the
+ratio of every median to a previous results file and exits with status 1 if
+one got slower than ``--threshold`` allows.
+
+.. code-block:: bash
+
+    python bonsai_benchmark.py --sizes 10 10000 100000 --clicks 2000
+    python bonsai_benchmark.py --suites database --json new.json \\
+        --compare old.json
+    python bonsai_benchmark.py --generate big.db --trees 1000000
+"""
+
+from datetime import date, timedelta, datetime
+import statistics
+import tracemalloc
+import subprocess
+import tempfile
+import argparse
+import platform
+import random
+import shutil
+import sqlite3
+import json
+import time
+import sys
+import os
+
+_SPECIES = (
+    "Chinese Elm",
+    "Trident Maple",
+    "Japanese Black Pine",
+    "Ficus",
+    "Satsuki Azalea",
+    "Juniper",
+    "Zelkova",
+)
+
+
+class _canvas:
+    r"""
+    Stand-in for the ``tk.Canvas`` of the app.
+    """
+
+    def __init__(self):
+        self.items = {}
+
+    def create_text(self, *args, **options):
+        item = len(self.items) + 1
+        self.items[item] = options
+        return item
+
+    def itemconfigure(self, item, **options):
+        self.items[item].update(options)
+
+
+class _entry:
+    r"""
+    Stand-in for a ``ctk.CTkEntry``. ``writes`` counts the rewrites.
+    """
+
+    def __init__(self, text: str = ""):
+        self.text = text
+        self.writes = 0
+
+    def get(self):
+        return self.text
+
+    def delete(self, first, last=None):
+        self.text = ""
+
+    def insert(self, index, text: str):
+        self.text = text
+        self.writes += 1
+
+    def configure(self, **options):
+        pass
+
+
+def random_trees(n: int, seed: int = 0):
+    r"""
+    :return: list of ``n`` bonsai with random action dates.
+    """
+    from bonsai_class import bonsai
+
+    rng = random.Random(seed)
+    start = date(2020, 1, 1)
+
+    def day():
+        if rng.random() < 0.2:
+            return None
+        return start + timedelta(days=rng.randrange(1500))
+
+    return [
+        bonsai(
+            treeid=treeid,
+            name=f"{rng.choice(_SPECIES)} {treeid}",
+            next_fertilize=day(),
+            last_pruning=day(),
+            last_repot=day(),
+            last_wiring=day(),
+        )
+        for treeid in range(n)
+    ]
+
+
+def headless_notifier(trees: list):
+    r"""
+    Builds a ``bonsai_notifier`` around ``trees`` without creating widgets.
+
+    :return: the notifier and the stand-in canvas.
+    """
+    from bonsai_class import change_set, tree_collection
+    from bonsai_info import info_store
+    import bonsai_notifier as app
+
+    app.canvas = _canvas()
+    notifier = object.__new__(app.bonsai_notifier)
+    notifier.trees = tree_collection(trees)
+    notifier.changes = change_set()
+    notifier.infos = info_store(None)  # no database, prefetching is skipped
+    notifier.actions = (
+        "next_fertilize",
+        "last_pruning",
+        "last_repot",
+        "last_wiring",
+    )
+    notifier.NameLabel = app.canvas.create_text(170, 25, text="")
+    notifier.DateInput = [_entry() for _ in notifier.actions]
+    notifier.entry_color = "white"
+    notifier.invalid = {}
+    notifier.entry_invalid = [False] * len(notifier.actions)
+    notifier.show_tree()
+    return notifier, app.canvas
+
+
+def bench_navigation(n: int, clicks: int = 2000):
+    r"""
+    Clicks ``clicks`` times forward and as many times back through a
+    collection of ``n`` trees.
+
+    :return: dictionary of the per click times in microseconds, the bytes
+        allocated while clicking and the number of entry rewrites.
+    """
+    notifier, _ = headless_notifier(random_trees(n))
+    for _ in range(min(n, 50)):  # warm the date and name caches
+        notifier.next_bonsai()
+
+    times = []
+    writes = sum(entry.writes for entry in notifier.DateInput)
+    tracemalloc.start()
+    base, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    for click in (notifier.next_bonsai, notifier.prev_bonsai):
+        for _ in range(clicks):
+            start = time.perf_counter()
+            click()
+            times.append(time.perf_counter() - start)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    times = sorted(t * 1e6 for t in times)
+    return {
+        "trees": n,
+        "clicks": len(times),
+        "mean_us": statistics.fmean(times),
+        "median_us": statistics.median(times),
+        "p99_us": times[int(0.99 * (len(times) - 1))],
+        "peak_alloc_bytes": peak - base,
+        "entry_writes": sum(e.writes for e in notifier.DateInput) - writes,
+    }
+
+
+def bench_search(n: int, queries: int = 200):
+    r"""
+    Types the names of ``queries`` random trees letter by letter into the
+    search of a collection of ``n`` trees. Building the index is timed
+    separately.
+
+    :return: dictionary of the index build time in milliseconds and the
+        per keystroke times in microseconds.
+    """
+    from bonsai_class import tree_collection
+
+    trees = random_trees(n)
+    collection = tree_collection(trees)
+    start = time.perf_counter()
+    collection.index_names()
+    build = time.perf_counter() - start
+
+    rng = random.Random(1)
+    times = []
+    for tree in rng.sample(trees, min(queries, n)):
+        for ii in range(1, len(tree.name) + 1):
+            start = time.perf_counter()
+            collection.search(tree.name[:ii])
+            times.append(time.perf_counter() - start)
+
+    times = sorted(t * 1e6 for t in times)
+    return {
+        "trees": n,
+        "build_ms": build * 1000,
+        "keystrokes": len(times),
+        "median_us": statistics.median(times),
+        "p99_us": times[int(0.99 * (len(times) - 1))],
+        "max_us": times[-1],
+    }
+
+
+# ----------------------------------GENERATOR-----------------------------------
+_ACTIONS = ("Fertilize", "Pruning", "Repot", "Wiring")
+_WORDS = (
+    "water daily feed half strength pinch new shoots after flowering keep"
+    " shade wire loosely check roots"
+).split()
+
+
+def random_notes(size: int, rng: random.Random):
+    r"""
+    :return: care notes ``{action: [points]}`` of about ``size`` bytes as
+        JSON.
+    """
+    notes = {action: [] for action in _ACTIONS}
+    left = size - 60  # brackets, quotes and action names
+    while left > 0:
+        point = " ".join(rng.choice(_WORDS) for _ in range(rng.randint(3, 8)))
+        notes[rng.choice(_ACTIONS)].append(point)
+        left -= len(point) + 4
+    return notes
+
+
+def generate_database(
+    db_file: str,
+    trees: int,
+    history: int = 1,
+    notes_bytes: int = 0,
+    seed: int = 0,
+    chunk_size: int = 5000,
+):
+    r"""
+    Builds a database with ``trees`` trees, numbered from 0, having
+    ``history`` saved versions each with random dates, and care notes of
+    about ``notes_bytes`` bytes per tree, none if 0. The database is
+    created by ``bonsai_database.initialize_table`` without sample trees and
+    filled in chunks by ``bonsai_database.import_records``, so it has the
+    schema and the versions the app writes.
+
+    :return: ``db_file``.
+    """
+    import bonsai_database as bonsai_db
+
+    rng = random.Random(seed)
+    start = date(2020, 1, 1)
+
+    def day():
+        if rng.random() < 0.2:
+            return None
+        return start + timedelta(days=rng.randrange(1500))
+
+    def records():
+        for treeid in range(trees):
+            name = f"{rng.choice(_SPECIES)} {treeid}"
+            for _ in range(history):
+                yield (treeid, name, day(), day(), day(), day())
+
+    conn = bonsai_db.create_connection(db_file)
+    bonsai_db.initialize_table(conn, samples=False)
+    bonsai_db.import_records(conn, records(), chunk_size, keep_ids=True)
+
+    if notes_bytes:
+        for first in range(0, trees, chunk_size):
+            last = min(first + chunk_size, trees)
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO info VALUES (?, ?)",
+                    (
+                        (treeid, json.dumps(random_notes(notes_bytes, rng)))
+                        for treeid in range(first, last)
+                    ),
+                )
+    conn.close()
+    return db_file
+
+
+# -----------------------------------DATABASE-----------------------------------
+def _summary(suite: str, name: str, n: int, times: list):
+    r"""
+    :return: result dictionary with the median and minimum of ``times`` in
+        milliseconds.
+    """
+    return {
+        "suite": suite,
+        "name": name,
+        "trees": n,
+        "runs": len(times),
+        "median_ms": statistics.median(times) * 1000,
+        "min_ms": min(times) * 1000,
+    }
+
+
+def _measure(suite: str, name: str, n: int, func, runs: int):
+    r"""
+    Calls ``func`` ``runs`` times.
+
+    :return: result dictionary, see :func:`_summary`.
+    """
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return _summary(suite, name, n, times)
+
+
+def bench_database(
+    db_file: str, n: int, repeat: int = 5, notes_bytes: int = 0
+):
+    r"""
+    Times the model and database layers on the ``n`` trees of ``db_file``,
+    a database built by :func:`generate_database`. Loads run ``repeat``
+    times, operations on single trees twenty times as often. A save changes
+    one date of up to 100 trees. The database is modified.
+
+    :return: list of result dictionaries, one per operation.
+    """
+    import bonsai_database as bonsai_db
+    from bonsai_class import bonsai, change_set
+
+    rng = random.Random(2)
+    conn = bonsai_db.create_connection(db_file)
+    point_runs = repeat * 20
+    results = [
+        _measure(
+            "database",
+            "initialize_table",
+            n,
+            lambda: bonsai_db.initialize_table(conn),
+            point_runs,
+        ),
+        _measure(
+            "database",
+            "db.load_database",
+            n,
+            lambda: bonsai_db.load_database(conn, versions=True),
+            repeat,
+        ),
+        _measure(
+            "database",
+            "bonsai.load_database",
+            n,
+            lambda: bonsai.load_database(conn),
+            repeat,
+        ),
+    ]
+
+    # every added tree is removed again, so both are timed alternately
+    added, removed = [], []
+    for ii in range(point_runs):
+        tree = bonsai(treeid=n + ii, name=f"Benchmark {ii}")
+        start = time.perf_counter()
+        bonsai_db.add_record(conn, tree)
+        added.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        bonsai_db.remove_record(conn, tree)
+        removed.append(time.perf_counter() - start)
+    results.append(_summary("database", "db.add_record", n, added))
+    results.append(_summary("database", "db.remove_record", n, removed))
+
+    trees = bonsai.load_database(conn)
+    changed = rng.sample(trees, min(n, 100))
+    changes = change_set()
+
+    def save():
+        for tree in changed:
+            tree.set_last_pruning(
+                date(2020, 1, 1) + timedelta(days=rng.randrange(1500))
+            )
+            changes.add(tree)
+        bonsai.save_database(conn, changes)
+
+    results.append(
+        _measure("database", "bonsai.save_database", n, save, point_runs)
+    )
+
+    notes = random_notes(notes_bytes or 1000, rng)
+    treeids = [rng.randrange(n) for _ in range(point_runs)]
+    results.append(
+        _measure(
+            "database",
+            "db.save_info",
+            n,
+            lambda: bonsai_db.save_info(conn, treeids.pop(), notes),
+            point_runs,
+        )
+    )
+    treeids = [rng.randrange(n) for _ in range(point_runs)]
+    results.append(
+        _measure(
+            "database",
+            "db.load_info",
+            n,
+            lambda: bonsai_db.load_info(conn, (treeids.pop(),)),
+            point_runs,
+        )
+    )
+    conn.close()
+    return results
+
+
+# -----------------------------------RESULTS------------------------------------
+def _commit():
+    r"""
+    :return: hash of the checked out commit, None outside of git.
+    """
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def results_document(results: list, settings: dict):
+    r"""
+    :return: dictionary of the results together with the commit, the
+        machine and the settings they were measured with.
+    """
+    return {
+        "commit": _commit(),
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "machine": platform.machine(),
+        "settings": settings,
+        "results": results,
+    }
+
+
+def _median(result: dict):
+    r"""
+    :return: median of a result in microseconds.
+    """
+    if "median_ms" in result:
+        return result["median_ms"] * 1000
+    return result["median_us"]
+
+
+def compare(old: dict, new: dict, threshold: float = 1.25):
+    r"""
+    Matches the results of two documents by suite, name and number of trees.
+
+    :return: list of tuples of the suite, the name, the number of trees, the
+        old and new median in microseconds, their ratio and whether the ratio
+        exceeds ``threshold``.
+    """
+    old_results = {
+        (r["suite"], r["name"], r["trees"]): r for r in old["results"]
+    }
+    rows = []
+    for result in new["results"]:
+        key = (result["suite"], result["name"], result["trees"])
+        if key not in old_results:
+            continue
+        before, after = _median(old_results[key]), _median(result)
+        ratio = after / before if before else float("inf")
+        rows.append(key + (before, after, ratio, ratio > threshold))
+    return rows
+
+
+def print_comparison(rows: list, old: dict, new: dict):
+    print(f"\n{old.get('commit')} -> {new.get('commit')}")
+    print(
+        f"{'suite':<11}{'name':<22}{'trees':>8} {'before':>10}"
+        f" {'after':>10} {'ratio':>6}"
+    )
+    for suite, name, n, before, after, ratio, slower in rows:
+        print(
+            f"{suite:<11}{name:<22}{n:>8} {before:>8.1f}us"
+            f" {after:>8.1f}us {ratio:>6.2f}{'  SLOWER' if slower else ''}"
+        )
+
+
+# ------------------------------------------------------------------------------
+
+
+def _database_file(directory: str, n: int, args: argparse.Namespace):
+    r"""
+    :return: path of a generated database in ``directory``, built unless a
+        previous run left it there.
+    """
+    db_file = os.path.join(
+        directory, f"bonsai_{n}_{args.history}_{args.notes_bytes}.db"
+    )
+    if not os.path.exists(db_file):
+        os.makedirs(directory, exist_ok=True)
+        print(f"generating {n} trees ...", file=sys.stderr)
+        generate_database(
+            db_file + ".part", n, args.history, args.notes_bytes
+        )
+        os.replace(db_file + ".part", db_file)
+    return db_file
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument(
+        "--suites",
+        nargs="+",
+        choices=("navigation", "search", "database"),
+        default=["navigation", "search", "database"],
+    )
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[10, 10_000, 100_000]
+    )
+    parser.add_argument(
+        "--clicks", type=int, default=2000, help="clicks per direction"
+    )
+    parser.add_argument(
+        "--db-sizes",
+        type=int,
+        nargs="+",
+        default=[10, 10_000, 1_000_000],
+        help="trees of the databases of the database suite",
+    )
+    parser.add_argument(
+        "--history", type=int, default=2, help="saved versions per tree"
+    )
+    parser.add_argument(
+        "--notes-bytes",
+        type=int,
+        default=500,
+        help="bytes of care notes per tree, 0 for none",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=5, help="runs of every load"
+    )
+    parser.add_argument(
+        "--data",
+        help="directory keeping the generated databases for further runs,"
+        " they are copied before being benchmarked",
+    )
+    parser.add_argument("--json", help="file to write the results to")
+    parser.add_argument(
+        "--compare",
+        nargs="+",
+        metavar="FILE",
+        help="results file to compare the run with, or two results files"
+        " to compare without running",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=1.25,
+        help="ratio of the medians counted as a regression",
+    )
+    parser.add_argument(
+        "--generate",
+        metavar="FILE",
+        help="only build a database of --trees trees in FILE",
+    )
+    parser.add_argument("--trees", type=int, default=1000)
+    args = parser.parse_args(argv)
+    if args.compare and len(args.compare) > 2:
+        parser.error("--compare takes one or two files")
+
+    if args.generate:
+        if os.path.exists(args.generate):
+            parser.error(f"'{args.generate}' exists already")
+        generate_database(
+            args.generate, args.trees, args.history, args.notes_bytes
+        )
+        return 0
+
+    if args.compare and len(args.compare) == 2:
+        with open(args.compare[0]) as file:
+            old = json.load(file)
+        with open(args.compare[1]) as file:
+            new = json.load(file)
+        rows = compare(old, new, args.threshold)
+        print_comparison(rows, old, new)
+        return int(any(row[-1] for row in rows))
+
+    results = []
+    if "navigation" in args.suites:
+        print(
+            f"{'trees':>8} {'mean':>9} {'median':>9} {'p99':>9}"
+            f" {'alloc':>9} {'writes':>7}"
+        )
+        for n in args.sizes:
+            result = bench_navigation(n, args.clicks)
+            results.append({"suite": "navigation", "name": "click", **result})
+            print(
+                f"{n:>8} {result['mean_us']:>7.1f}us"
+                f" {result['median_us']:>7.1f}us {result['p99_us']:>7.1f}us"
+                f" {result['peak_alloc_bytes']:>8}B"
+                f" {result['entry_writes']:>7}"
+            )
+
+    if "search" in args.suites:
+        print(
+            f"\n{'trees':>8} {'index':>9} {'median':>9} {'p99':>9}"
+            f" {'max':>9}"
+        )
+        for n in args.sizes:
+            result = bench_search(n)
+            results.append({"suite": "search", "name": "keystroke", **result})
+            print(
+                f"{n:>8} {result['build_ms']:>7.1f}ms"
+                f" {result['median_us']:>7.1f}us {result['p99_us']:>7.1f}us"
+                f" {result['max_us']:>7.1f}us"
+            )
+
+    if "database" in args.suites:
+        print(f"\n{'trees':>8} {'median':>11} {'min':>11}  operation")
+        with tempfile.TemporaryDirectory() as directory:
+            for n in args.db_sizes:
+                db_file = os.path.join(directory, "bench.db")
+                shutil.copy(
+                    _database_file(args.data or directory, n, args), db_file
+                )
+                for result in bench_database(
+                    db_file, n, args.repeat, args.notes_bytes
+                ):
+                    results.append(result)
+                    print(
+                        f"{n:>8} {result['median_ms']:>9.3f}ms"
+                        f" {result['min_ms']:>9.3f}ms  {result['name']}"
+                    )
+                os.remove(db_file)
+
+    settings = {
+        key: getattr(args, key)
+        for key in ("clicks", "history", "notes_bytes", "repeat")
+    }
+    document = results_document(results, settings)
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(document, file, indent=1)
+    if args.compare:
+        with open(args.compare[0]) as file:
+            old = json.load(file)
+        rows = compare(old, document, args.threshold)
+        print_comparison(rows, old, document)
+        return int(any(row[-1] for row in rows))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
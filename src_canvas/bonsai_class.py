@@ -8,14 +8,21 @@ Author: Viktor Pfaffenrot
 
 This class creates a bonsai with an id, a name and action attributes 
 namely when to next fertilize, when was the last pruning, the last repotting and the last wiring.
+The action dates are ``datetime.date`` objects or None if the action did not happen yet.
 """
 
-from dataclasses import dataclass, field
+from collections import namedtuple
+from datetime import date
 import bonsai_database as bonsai_db
-import os
+import weakref
+import bisect
+import heapq
+import re
+import time
+
+_WORD_START = re.compile(r"(?<=\s)\S")  # first letter of every further word
 
 
-@dataclass()
 class bonsai:
     r"""
     Setters of the action attributes
@@ -25,86 +32,557 @@ class bonsai:
     .. automethod:: set_last_repot
     .. automethod:: set_last_wiring
 
+    Trees of several collection databases can be loaded at once, a tree is
+    identified by its ``key`` ``(collection, treeid)``. Instances use
+    ``__slots__`` and are kept in a weak identity map keyed by ``key``, so
+    every tree is represented by exactly one object while it is referenced
+    anywhere. Creating a second instance of a live tree raises ``KeyError``,
+    :meth:`from_record` reuses the live instance instead.
+
+    ``version`` is the version of the tree in the database, None until it is
+    saved for the first time. Saves check it, so changes made meanwhile by
+    another instance of the app are not overwritten, see
+    ``bonsai_database.add_records``.
+
     Remaining:
     """
 
-    all = []  #:keeps track of all the created instances
-    treeid: int = 1
-    name: str = "bonsai"
-    next_fertilize: str = "Not Yet"
-    last_pruning: str = "Not Yet"
-    last_repot: str = "Not Yet"
-    last_wiring: str = "Not Yet"
-    info: str = ""
+    #: attributes compared by ``==`` and shown by ``repr``
+    fields = (
+        "treeid",
+        "name",
+        "next_fertilize",
+        "last_pruning",
+        "last_repot",
+        "last_wiring",
+        "collection",
+        "version",
+    )
+    __slots__ = fields + ("dirty", "__weakref__")
+
+    #: identity map of the live instances, keyed by (collection, treeid)
+    _registry = weakref.WeakValueDictionary()
 
-    def __post_init__(self):
-        bonsai.all.append(self)
+    def __init__(
+        self,
+        treeid: int = 1,
+        name: str = "bonsai",
+        next_fertilize: date = None,
+        last_pruning: date = None,
+        last_repot: date = None,
+        last_wiring: date = None,
+        collection: str = bonsai_db.MAIN,
+        version: int = None,
+    ):
+        self.treeid = treeid
+        self.name = name
+        self.next_fertilize = next_fertilize
+        self.last_pruning = last_pruning
+        self.last_repot = last_repot
+        self.last_wiring = last_wiring
+        #: name of the collection database the tree is stored in
+        self.collection = collection
+        #: version of the stored tree the fields are based on
+        self.version = version
+        #: fields changed since the last save -> their stored values
+        self.dirty = {}
+        if self.key in bonsai._registry:
+            raise KeyError(f"tree {self.key} is already alive")
+        bonsai._registry[self.key] = self
 
-    # =============================================================================
-    #         for field in fields(self):
-    #             if not isinstance(field.default, dataclasses._MISSING_TYPE) and getattr(self, field.name) is None:
-    #                 setattr(self, field.name, field.default)
-    # =============================================================================
+    def __repr__(self):
+        values = ", ".join(
+            f"{key}={getattr(self, key)!r}" for key in self.fields
+        )
+        return f"bonsai({values})"
+
+    def __eq__(self, other):
+        if not isinstance(other, bonsai):
+            return NotImplemented
+        return all(
+            getattr(self, key) == getattr(other, key) for key in self.fields
+        )
 
     def __hash__(self):
-        return hash(tuple(self))
+        return hash(self.key)
+
+    @property
+    def key(self):
+        r"""
+        Tuple ``(collection, treeid)`` identifying the tree across collections.
+        """
+        return (self.collection, self.treeid)
+
+    @classmethod
+    def from_record(
+        cls,
+        record: tuple,
+        collection: str = bonsai_db.MAIN,
+        version: int = None,
+    ):
+        r"""
+        Returns the instance for a row of ``bonsai_database.load_database()``
+        of ``collection`` stored with ``version``. An already living instance
+        of the same tree is updated and reused.
+
+        :return: bonsai object.
+        """
+        tree = cls._registry.get((collection, record[0]))
+        if tree is None:
+            return cls(*record, collection=collection, version=version)
+        for key, value in zip(cls.fields[1:], record[1:]):
+            setattr(tree, key, value)
+        tree.version = version
+        tree.dirty.clear()
+        return tree
 
     # @staticmethod
-    def initiate_database(db_file: str):
+    def initiate_database(conn):
         r"""
         This method initializes the bonsai database if not already existent. Calls ``bonsai_database.initialize_table()``
         """
-        conn = bonsai_db.create_connection(db_file)
         bonsai_db.initialize_table(conn)
 
     @classmethod
-    def load_database(cls, db_file: str):
+    def load_database(cls, conn, collections: bool = False):
         r"""
-        Loads the bonsai database. Calls ``bonsai_database.load_database()``
+        Loads the bonsai database. Calls ``bonsai_database.load_database()``,
+        or ``bonsai_database.load_collections()`` with ``collections`` to load
+        the trees of all attached collections.
 
         :return: List of bonsai objects.
         """
-        conn = bonsai_db.create_connection(db_file)
-        db = bonsai_db.load_database(conn)
-        mytrees = []
-        for item in db:
-            mytrees.append(
-                bonsai(
-                    treeid=item[0],
-                    name=item[1],
-                    next_fertilize=item[2],
-                    last_pruning=item[3],
-                    last_repot=item[4],
-                    last_wiring=item[5],
-                )
-            )
+        if collections:
+            db = bonsai_db.load_collections(conn)
+            return [cls.from_record(item[2:], *item[:2]) for item in db]
+        db = bonsai_db.load_database(conn, versions=True)
+        mytrees = [cls.from_record(item[1:], version=item[0]) for item in db]
         return mytrees
 
-    # @staticmethod
-    def update_database(self, db_file: str, add: bool):
+    @staticmethod
+    def save_database(conn, changes: "change_set"):
+        r"""
+        Writes all pending changes in one transaction and marks the trees as
+        clean afterwards. Calls ``bonsai_database.add_records()``, which
+        raises ``bonsai_database.version_conflict`` if another instance saved
+        any of the trees meanwhile; the changes are kept then.
+
+        :return: Tuple of the number of rows written and the write time in seconds.
+        """
+        result = bonsai.save_records(
+            conn,
+            changes.dirty.values(),
+            changes.removed.values(),
+            changes.notes,
+        )
+        for tree in changes.dirty.values():
+            tree.version = (tree.version or 0) + 1
+            tree.dirty.clear()
+        changes.clear()
+        return result
+
+    @staticmethod
+    def save_records(conn, records, removed=(), notes=None):
         r"""
-        Updates the bonsai database. Calls ``bonsai_database.add_record()`` or ``bonsai_database.remove_record()`` depending on add flag
+        Writes trees or their snapshots in one transaction without touching
+        the trees, so it can run in a background thread on snapshots taken
+        by :meth:`snapshot`. Calls ``bonsai_database.add_records()``; the
+        written trees have the version of the snapshot plus one. ``notes``
+        are care notes by ``key`` written in the same transaction.
+
+        :return: Tuple of the number of rows written and the write time in seconds.
+        """
+        start = time.perf_counter()
+        rows = bonsai_db.add_records(conn, records, removed, notes)
+        return rows, time.perf_counter() - start
+
+    def snapshot(self):
+        r"""
+        :return: ``bonsai_record`` with the current values of the fields.
         """
-        conn = bonsai_db.create_connection(db_file)
+        return bonsai_record(
+            self.treeid,
+            self.name,
+            self.next_fertilize,
+            self.last_pruning,
+            self.last_repot,
+            self.last_wiring,
+            self.collection,
+            self.version,
+        )
 
-        if add:
-            bonsai_db.add_record(conn, self)
+    def set_action(self, action: str, value: date):
+        r"""
+        Sets a single attribute and marks it dirty if the value changed. A
+        field set back to its stored value is clean again.
+
+        :return: True if the value changed.
+        """
+        old = getattr(self, action)
+        if old == value:
+            return False
+        setattr(self, action, value)
+        stored = self.dirty.setdefault(action, old)
+        if stored == value:
+            del self.dirty[action]
+        return True
+
+    def saved_as(self, record: "bonsai_record"):
+        r"""
+        Takes the values of ``record``, the snapshot just written, as the
+        stored ones. Fields changed since the snapshot stay dirty.
+        """
+        self.dirty = {
+            key: getattr(record, key)
+            for key in bonsai_db.DATE_COLUMNS
+            if getattr(self, key) != getattr(record, key)
+        }
+
+    def set_next_fertilize(self, next_fertilize: date):
+        return self.set_action("next_fertilize", next_fertilize)
+
+    def set_last_pruning(self, last_pruning: date):
+        return self.set_action("last_pruning", last_pruning)
+
+    def set_last_repot(self, last_repot: date):
+        return self.set_action("last_repot", last_repot)
+
+    def set_last_wiring(self, last_wiring: date):
+        return self.set_action("last_wiring", last_wiring)
+
+
+#: immutable copy of the fields of a tree, see :meth:`bonsai.snapshot`
+bonsai_record = namedtuple("bonsai_record", bonsai.fields)
+
+
+class change_set:
+    r"""
+    Trees waiting to be written on the next save, keyed by ``key``. Added and
+    modified trees are kept in ``dirty``, deleted ones in ``removed``. Removals
+    are applied before inserts, so an id freed in the same session can be
+    reused by a new tree. The care notes of trees not saved yet are kept in
+    ``notes`` and written with them.
+    """
+
+    def __init__(self):
+        self.dirty = {}
+        self.removed = {}
+        self.notes = {}
+
+    def add(self, tree: bonsai):
+        self.dirty[tree.key] = tree
+
+    def remove(self, tree: bonsai):
+        self.dirty.pop(tree.key, None)
+        self.notes.pop(tree.key, None)
+        self.removed[tree.key] = tree
+
+    def clear(self):
+        self.dirty.clear()
+        self.removed.clear()
+        self.notes.clear()
+
+    def take(self):
+        r"""
+        Hands the pending changes over to a save and empties the set, so
+        changes made while the save runs are collected for the next one.
+
+        :return: change_set with the taken changes.
+        """
+        taken = change_set()
+        taken.dirty, self.dirty = self.dirty, {}
+        taken.removed, self.removed = self.removed, {}
+        taken.notes, self.notes = self.notes, {}
+        return taken
+
+    def merge(self, taken: "change_set"):
+        r"""
+        Puts back the changes of a failed save. A tree removed in the meantime
+        stays removed.
+        """
+        for key, tree in taken.dirty.items():
+            if key not in self.removed:
+                self.dirty.setdefault(key, tree)
+        for key, tree in taken.removed.items():
+            self.dirty.pop(key, None)
+            self.notes.pop(key, None)
+            self.removed[key] = tree
+        for key, notes in taken.notes.items():
+            if key not in self.removed:
+                self.notes.setdefault(key, notes)
+
+    def drop_clean(self):
+        r"""
+        Drops stored trees whose changed fields were all set back to their
+        stored values, they need no new version.
+
+        :return: number of trees dropped.
+        """
+        clean = [
+            key
+            for key, tree in self.dirty.items()
+            if tree.version is not None and not tree.dirty
+        ]
+        for key in clean:
+            del self.dirty[key]
+        return len(clean)
+
+    def __len__(self):
+        return len(self.dirty) + len(self.removed) + len(self.notes)
+
+
+class tree_collection:
+    r"""
+    The trees of the collection in display order with a cursor on the shown
+    tree. Trees are indexed by ``key`` and by name, and the order is kept as a
+    ring of ``key`` links, so adding, removing, looking up and moving the
+    cursor do not depend on the size of the collection. The trees may come
+    from several collection databases; ``max_ids`` only grows per
+    collection, new trees never reuse the id of a tree removed in this
+    session.
+
+    For :meth:`search`, the case folded names and the remainders of the names
+    starting at every further word are kept in a sorted list, so a prefix is
+    found by bisection and adding or removing a tree only inserts or deletes
+    its own keys. The list can be built off the main thread by
+    :meth:`name_index` and installed with :meth:`set_index`, else it is built
+    on the first search.
+
+    .. automethod:: step
+    .. automethod:: by_name
+    .. automethod:: search
+    .. automethod:: new_id
+    .. automethod:: renumber
+    """
+
+    def __init__(self, trees=()):
+        self._by_key = {}
+        self._by_name = {}  # name -> {key: tree}, names may repeat
+        self._next = {}
+        self._prev = {}
+        self._head = None
+        self.current = None  #: the tree under the cursor
+        self.max_ids = {}  #: largest treeid seen per collection
+        self._keys = None  # search index, see index_names()
+        #: number of changes of the trees, see set_index()
+        self.generation = 0
+        for tree in trees:
+            self._link(tree)
+
+    def __len__(self):
+        return len(self._by_key)
+
+    def __contains__(self, tree):
+        return self._by_key.get(tree.key) is tree
+
+    def __iter__(self):
+        key = self._head
+        for _ in range(len(self._by_key)):
+            yield self._by_key[key]
+            key = self._next[key]
+
+    def get(self, treeid: int, collection: str = bonsai_db.MAIN):
+        r"""
+        :return: the tree with this treeid or None.
+        """
+        return self._by_key.get((collection, treeid))
+
+    def by_name(self, name: str):
+        r"""
+        :return: the first added tree of this name or None.
+        """
+        trees = self._by_name.get(name)
+        return next(iter(trees.values())) if trees else None
+
+    def new_id(self, collection: str = bonsai_db.MAIN):
+        r"""
+        :return: an unused treeid of ``collection``.
+        """
+        max_id = self.max_ids.get(collection)
+        return 0 if max_id is None else max_id + 1
+
+    @staticmethod
+    def _name_keys(tree: bonsai):
+        name = tree.name.casefold()
+        yield name
+        for word in _WORD_START.finditer(name):
+            yield name[word.start() :]
+
+    @staticmethod
+    def name_index(trees):
+        r"""
+        Builds a search index of ``trees`` without touching a collection, so
+        it can run in a background thread on the list the collection was
+        made of.
+
+        :return: sorted list of the name keys, see :meth:`set_index`.
+        """
+        keys = [
+            (key, tree.key)
+            for tree in trees
+            for key in tree_collection._name_keys(tree)
+        ]
+        # sorting holds the GIL, sorted runs of 10k keys merged in Python
+        # keep the main thread responsive meanwhile
+        runs = [
+            sorted(keys[ii : ii + 10000]) for ii in range(0, len(keys), 10000)
+        ]
+        if len(runs) == 1:
+            return runs[0]
+        return list(heapq.merge(*runs))
+
+    def set_index(self, keys: list, generation: int):
+        r"""
+        Installs a search index built by :meth:`name_index` from the trees of
+        ``generation``. It is dropped if the trees changed meanwhile.
+        """
+        if self._keys is None and generation == self.generation:
+            self._keys = keys
+
+    def index_names(self):
+        r"""
+        Builds the search index unless it exists. Call it ahead of the first
+        :meth:`search` to keep that one fast as well.
+        """
+        if self._keys is None:
+            self._keys = self.name_index(self)
+
+    def search(self, prefix: str, limit: int = 10):
+        r"""
+        Finds the trees whose name or one of its words starts with ``prefix``,
+        ignoring case.
+
+        :return: list of at most ``limit`` trees in alphabetical order.
+        """
+        prefix = prefix.strip().casefold()
+        if not prefix:
+            return []
+        self.index_names()
+        found = {}
+        ii = bisect.bisect_left(self._keys, (prefix,))
+        while ii < len(self._keys) and len(found) < limit:
+            key, tree_key = self._keys[ii]
+            if not key.startswith(prefix):
+                break
+            found.setdefault(tree_key, self._by_key[tree_key])
+            ii += 1
+        return list(found.values())
+
+    def append(self, tree: bonsai):
+        r"""
+        Adds a tree at the end of the order. The first tree becomes current.
+        """
+        self._link(tree)
+        if self._keys is not None:
+            for key in self._name_keys(tree):
+                bisect.insort(self._keys, (key, tree.key))
+
+    def _link(self, tree: bonsai):
+        key = tree.key
+        if key in self._by_key:
+            raise KeyError(f"tree {key} is already in the collection")
+        self._by_key[key] = tree
+        self._by_name.setdefault(tree.name, {})[key] = tree
+        if self._head is None:
+            self._head = key
+            self._next[key] = self._prev[key] = key
+            self.current = tree
         else:
-            bonsai_db.remove_record(conn, self)
+            tail = self._prev[self._head]
+            self._next[tail] = self._prev[self._head] = key
+            self._prev[key] = tail
+            self._next[key] = self._head
+        max_id = self.max_ids.get(tree.collection)
+        if max_id is None or tree.treeid > max_id:
+            self.max_ids[tree.collection] = tree.treeid
+        self.generation += 1
 
-    def set_next_fertilize(self, next_fertilize: str):
-        self.next_fertilize = next_fertilize
+    def remove(self, tree: bonsai):
+        r"""
+        Removes a tree. If it is the current one, the cursor moves to the
+        previous tree.
+        """
+        key = tree.key
+        del self._by_key[key]
+        self.generation += 1
+        names = self._by_name[tree.name]
+        del names[key]
+        if not names:
+            del self._by_name[tree.name]
+        if self._keys is not None:
+            for name_key in self._name_keys(tree):
+                del self._keys[bisect.bisect_left(self._keys, (name_key, key))]
 
-    def set_last_pruning(self, last_pruning: str):
-        self.last_pruning = last_pruning
+        prev, next_ = self._prev.pop(key), self._next.pop(key)
+        if prev == key:
+            self._head = self.current = None
+            return
+        self._next[prev] = next_
+        self._prev[next_] = prev
+        if self._head == key:
+            self._head = next_
+        if self.current is tree:
+            self.current = self._by_key[prev]
 
-    def set_last_repot(self, last_repot: str):
-        self.last_repot = last_repot
+    def renumber(self, tree: bonsai, treeid: int):
+        r"""
+        Gives a tree of the collection a new ``treeid`` and keeps its place in
+        the order, e.g. when another instance of the app saved a tree with
+        its id before it was saved.
+        """
+        old = tree.key
+        self.generation += 1
+        if self._keys is not None:
+            for name_key in self._name_keys(tree):
+                del self._keys[bisect.bisect_left(self._keys, (name_key, old))]
+        if bonsai._registry.get(old) is tree:
+            del bonsai._registry[old]
+        tree.treeid = treeid
+        key = tree.key
+        bonsai._registry[key] = tree
 
-    def set_last_wiring(self, last_wiring: str):
-        self.last_wiring = last_wiring
+        del self._by_key[old]
+        self._by_key[key] = tree
+        names = self._by_name[tree.name]
+        del names[old]
+        names[key] = tree
+        prev, next_ = self._prev.pop(old), self._next.pop(old)
+        if prev == old:
+            prev = next_ = key
+        self._next[prev] = self._prev[next_] = key
+        self._prev[key], self._next[key] = prev, next_
+        if self._head == old:
+            self._head = key
+        if treeid > self.max_ids.get(tree.collection, -1):
+            self.max_ids[tree.collection] = treeid
+        if self._keys is not None:
+            for name_key in self._name_keys(tree):
+                bisect.insort(self._keys, (name_key, key))
+
+    def neighbour(self, tree: bonsai, offset: int = 1):
+        r"""
+        :return: the tree after (``offset=1``) or before (``offset=-1``)
+            ``tree``; the order wraps around.
+        """
+        links = self._next if offset > 0 else self._prev
+        key = tree.key
+        for _ in range(abs(offset)):
+            key = links[key]
+        return self._by_key[key]
+
+    def step(self, offset: int = 1):
+        r"""
+        Moves the cursor by ``offset`` trees.
 
-    def set_info(self, db_file: str):
-        db_path = os.path.split(db_file)
-        db_path = db_path[0]
-        self.info = db_path + "/" + self.name.replace(" ", "_") + ".json"
+        :return: the new current tree.
+        """
+        self.current = self.neighbour(self.current, offset)
+        return self.current
+
+    def select(self, tree: bonsai):
+        r"""
+        Moves the cursor to ``tree``.
+        """
+        if tree not in self:
+            raise KeyError(f"tree {tree.key} is not in the collection")
+        self.current = tree
@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Author: Viktor Pfaffenrot
+
+
+Command line maintenance of the bonsai database. Neither Tk nor PIL is
+imported, so the commands run on machines without a display.
+
+.. code-block:: bash
+
+    python bonsai_cli.py compact --keep-versions 10 --keep-days 365
+    python bonsai_cli.py import nursery.csv
+    python bonsai_cli.py export --history history.json
+    python bonsai_cli.py due --within 7d --action fertilize
+    python bonsai_cli.py --collection garden=db/garden.db due --within 7d
+"""
+
+from datetime import date, timedelta
+from contextlib import contextmanager
+import bonsai_database as bonsai_db
+import bonsai_transfer
+import argparse
+import json
+import time
+import sys
+import os
+
+_DEFAULT_DB = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "db/bonsai_database.db"
+)
+
+
+def compact(db: object, args: argparse.Namespace):
+    r"""
+    Prunes the history with the retention policy given on the command line.
+    """
+    keep_since = None
+    if args.keep_days is not None:
+        keep_since = int(time.time() - args.keep_days * 86400)
+
+    result = bonsai_db.compact_history(
+        db.conn,
+        keep_versions=args.keep_versions,
+        keep_since=keep_since,
+        batch_rows=args.batch_rows,
+    )
+    print(
+        f"removed {result['rows_removed']} history rows in"
+        f" {result['batches']} batches,"
+        f" reclaimed {result['bytes_reclaimed']} bytes"
+    )
+
+
+@contextmanager
+def _open(path: str, mode: str):
+    r"""
+    Opens a file for the csv module, ``-`` stands for stdin or stdout.
+    """
+    if path == "-":
+        yield sys.stdin if mode == "r" else sys.stdout
+        return
+    with open(path, mode, newline="", encoding="utf-8") as file:
+        yield file
+
+
+def import_trees(db: object, args: argparse.Namespace):
+    r"""
+    Imports the trees of a CSV or JSON file.
+    """
+    start = time.perf_counter()
+    with _open(args.file, "r") as file:
+        written, skipped = bonsai_transfer.import_file(
+            db.conn,
+            file,
+            args.format,
+            keep_ids=args.keep_ids,
+            chunk_size=args.chunk_size,
+            errors=bonsai_transfer.print_error,
+            renumbered=bonsai_transfer.print_renumbered,
+        )
+    print(
+        f"imported {written} trees, skipped {skipped} rows"
+        f" in {time.perf_counter() - start:.2f} s",
+        file=sys.stderr,
+    )
+
+
+def export_trees(db: object, args: argparse.Namespace):
+    r"""
+    Writes the trees or their history to a CSV or JSON file.
+    """
+    with _open(args.file, "w") as file:
+        count = bonsai_transfer.export_file(
+            db.conn, file, args.format, history=args.history
+        )
+    print(f"exported {count} rows", file=sys.stderr)
+
+
+def collection(text: str):
+    r"""
+    Parses a collection given as ``NAME=FILE``. The file must exist, so a
+    mistyped path does not create an empty database.
+
+    :return: tuple of name and file.
+    """
+    name, _, db_file = text.partition("=")
+    if not name.isidentifier() or not db_file:
+        raise argparse.ArgumentTypeError(f"'{text}' is no NAME=FILE")
+    if name.lower() in (bonsai_db.MAIN, "temp"):
+        raise argparse.ArgumentTypeError(f"'{name}' is reserved")
+    if not os.path.exists(db_file):
+        raise argparse.ArgumentTypeError(f"'{db_file}' does not exist")
+    return name, db_file
+
+
+def duration(text: str):
+    r"""
+    Parses a duration like ``7d``, ``2w`` or ``7``.
+
+    :return: number of days.
+    """
+    text = text.strip().lower()
+    weeks = text.endswith("w")
+    try:
+        days = int(text.rstrip("dw"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"'{text}' is no duration like 7d")
+    if days < 0:
+        raise argparse.ArgumentTypeError("the duration must not be negative")
+    return days * 7 if weeks else days
+
+
+def due(db: object, args: argparse.Namespace):
+    r"""
+    Prints the actions due within the given number of days, overdue ones
+    included, earliest first. The dates are compared in SQL on the index of
+    the due column, over all collections in one query.
+
+    :return: 1 with ``--check`` if anything is due, else 0.
+    """
+    today = date.today()
+    until = today + timedelta(days=args.within + 1)
+    reminders = []
+    for column, action in bonsai_db.REMINDERS:
+        if args.action not in (None, action):
+            continue
+        index = bonsai_db.DATE_COLUMNS.index(column) + 2
+        for record in bonsai_db.load_due(
+            db.conn, until, column, collections=True
+        ):
+            due_date = record[index + 1]
+            reminders.append(
+                {
+                    "collection": record[0],
+                    "treeid": record[1],
+                    "name": record[2],
+                    "action": action,
+                    "due": due_date.isoformat(),
+                    "days": (due_date - today).days,
+                }
+            )
+    reminders.sort(key=lambda reminder: reminder["due"])
+
+    for reminder in reminders:
+        if args.format == "json":
+            print(json.dumps(reminder))
+        else:
+            print("\t".join(str(value) for value in reminder.values()))
+    return int(args.check and bool(reminders))
+
+
+# ------------------------------------------------------------------------------
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--db", default=_DEFAULT_DB)
+    parser.add_argument(
+        "--collection",
+        type=collection,
+        action="append",
+        default=[],
+        help="further collection database as NAME=FILE, used by due",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    parser_compact = commands.add_parser(
+        "compact",
+        help="prune the history of the trees",
+        description="Prunes the history of all trees. A row is kept if "
+        "either limit keeps it, the latest state of a tree is always kept.",
+    )
+    parser_compact.add_argument(
+        "--keep-versions",
+        type=int,
+        help="keep the newest N versions of each tree",
+    )
+    parser_compact.add_argument(
+        "--keep-days",
+        type=float,
+        help="keep the versions saved in the last N days",
+    )
+    parser_compact.add_argument(
+        "--batch-rows",
+        type=int,
+        default=1000,
+        help="rows deleted per transaction",
+    )
+    parser_compact.set_defaults(run=compact)
+
+    parser_import = commands.add_parser(
+        "import", help="import trees from a CSV or JSON file"
+    )
+    parser_import.add_argument("file", help="file to read, - for stdin")
+    parser_import.add_argument("--format", choices=("csv", "json"))
+    parser_import.add_argument(
+        "--keep-ids",
+        action="store_true",
+        help="use the treeid column instead of new ids; rows of one id are"
+        " versions of one tree, ids of stored trees are given new ones",
+    )
+    parser_import.add_argument(
+        "--chunk-size",
+        type=int,
+        default=5000,
+        help="trees written per transaction",
+    )
+    parser_import.set_defaults(run=import_trees)
+
+    parser_export = commands.add_parser(
+        "export", help="export the trees to a CSV or JSON file"
+    )
+    parser_export.add_argument("file", help="file to write, - for stdout")
+    parser_export.add_argument("--format", choices=("csv", "json"))
+    parser_export.add_argument(
+        "--history",
+        action="store_true",
+        help="export every saved version instead of the latest state",
+    )
+    parser_export.set_defaults(run=export_trees)
+
+    parser_due = commands.add_parser(
+        "due",
+        help="list the actions due soon",
+        description="Prints one line per due action: JSON lines with the "
+        "keys collection, treeid, name, action, due and days, or tab "
+        "separated values in that order. days is negative for overdue "
+        "actions.",
+    )
+    parser_due.add_argument(
+        "--within",
+        type=duration,
+        default=0,
+        help="days ahead like 7d or 2w, overdue actions are always listed",
+    )
+    parser_due.add_argument(
+        "--action", choices=[action for _, action in bonsai_db.REMINDERS]
+    )
+    parser_due.add_argument(
+        "--format", choices=("json", "tsv"), default="json"
+    )
+    parser_due.add_argument(
+        "--check",
+        action="store_true",
+        help="exit with status 1 if anything is due",
+    )
+    parser_due.set_defaults(run=due)
+
+    args = parser.parse_args(argv)
+    if args.command == "compact" and (
+        args.keep_versions is None and args.keep_days is None
+    ):
+        parser_compact.error("give --keep-versions and/or --keep-days")
+    if args.command in ("import", "export"):
+        try:
+            args.format = bonsai_transfer.file_format(args.file, args.format)
+        except ValueError as e:
+            parser.error(str(e))
+
+    with bonsai_db.database_connection(args.db) as db:
+        bonsai_db.initialize_table(db.conn)
+        bonsai_db.attach_collections(db.conn, dict(args.collection))
+        return args.run(db, args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
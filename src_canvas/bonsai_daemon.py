@@ -0,0 +1,407 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Author: Viktor Pfaffenrot
+
+
+Headless reminder daemon. It reads the bonsai database through
+``bonsai_database``, keeps the upcoming (due date, tree, action) events in a
+min-heap and sleeps until the next one is due. All events due at a time are
+coalesced into one digest, and at most one digest is sent per
+``--digest-interval``; the digest is passed to a sink, which prints it,
+appends it to a log file or sends it to a local socket.
+
+Sent reminders are stored in the ``delivered`` table, so a restarted daemon
+or a cron job running ``--once`` does not send them again. A reminder whose
+due date did not change is repeated every ``--repeat-days`` until the action
+is done. Changes made by the GUI or other scripts are noticed through
+SQLite's ``data_version`` counter; only the trees written since the last check
+are read again and only their heap entries are replaced. Neither Tk nor PIL is
+imported, so the daemon runs on machines without a display:
+
+.. code-block:: bash
+
+    python bonsai_daemon.py --sink file:reminders.log --at 08:00
+"""
+
+from datetime import date, datetime, time, timedelta
+from bonsai_schedule import next_fertilize, species_of
+import bonsai_database as bonsai_db
+import threading
+import argparse
+import socket
+import signal
+import heapq
+import json
+import sys
+import os
+
+_ACTION_COLUMNS = {action: column for column, action in bonsai_db.REMINDERS}
+
+
+# -----------------------------------SINKS--------------------------------------
+class stdout_sink:
+    r"""
+    Prints every digest as one JSON line.
+    """
+
+    def emit(self, digest: dict):
+        print(json.dumps(digest), flush=True)
+
+    def close(self):
+        pass
+
+
+class file_sink:
+    r"""
+    Appends every digest as one JSON line to a log file.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def emit(self, digest: dict):
+        with open(self.path, "a") as log_file:
+            log_file.write(json.dumps(digest) + "\n")
+
+    def close(self):
+        pass
+
+
+class socket_sink:
+    r"""
+    Sends every digest as a JSON datagram to a local unix socket. This is a
+    stand-in for a real notification service listening on that socket.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+
+    def emit(self, digest: dict):
+        self.sock.sendto(json.dumps(digest).encode(), self.path)
+
+    def close(self):
+        self.sock.close()
+
+
+def create_sink(spec: str):
+    r"""
+    Creates a sink from a command line spec: ``stdout``, ``file:PATH`` or
+    ``socket:PATH``.
+    """
+    kind, _, path = spec.partition(":")
+    if kind == "stdout":
+        return stdout_sink()
+    if kind == "file" and path:
+        return file_sink(path)
+    if kind == "socket" and path:
+        return socket_sink(path)
+    raise ValueError(f"unknown sink '{spec}'")
+
+
+# ---------------------------------DAEMON---------------------------------------
+class reminder_daemon:
+    r"""
+    Schedules reminders of the trees in the database connected to ``conn``.
+    A reminder fires at ``remind_at`` on its due date; overdue reminders fire
+    right away. A reminder already sent for the same due date fires again
+    ``repeat_after`` after it was sent, never if ``repeat_after`` is None.
+    Reminders due together are sent as one digest listing at most
+    ``max_items`` of them, digests are at least ``digest_interval`` seconds
+    apart. ``check_interval`` bounds how long the daemon sleeps before it
+    looks for database changes.
+
+    .. automethod:: run
+    """
+
+    def __init__(
+        self,
+        conn,
+        sink: object,
+        remind_at: time = time(8, 0),
+        check_interval: float = 60.0,
+        digest_interval: float = 3600.0,
+        repeat_after: timedelta = timedelta(days=3),
+        max_items: int = 50,
+    ):
+        self.conn = conn
+        self.sink = sink
+        self.remind_at = remind_at
+        self.check_interval = check_interval
+        self.digest_interval = timedelta(seconds=digest_interval)
+        self.repeat_after = repeat_after
+        self.max_items = max_items
+
+        self.heap = []  #: entries (when, treeid, action, name)
+        self.scheduled = {}  #: (treeid, action) -> when, to skip stale entries
+        #: (treeid, action) -> (due, sent_at) of the last reminder sent
+        self.delivered = bonsai_db.load_delivered(conn)
+        last_sent = max((s for _, s in self.delivered.values()), default=None)
+        self.next_digest = datetime.min
+        if last_sent is not None:
+            self.next_digest = (
+                datetime.fromtimestamp(last_sent) + self.digest_interval
+            )
+        self.last_histid = 0
+        self.data_version = None
+        self._wake = threading.Event()
+        self._running = False
+
+    def _when(self, key: tuple, due: date):
+        r"""
+        :return: time the reminder of ``key`` due on ``due`` fires, None if
+            it was sent and is not repeated.
+        """
+        when = datetime.combine(due, self.remind_at)
+        sent = self.delivered.get(key)
+        if sent is not None and sent[0] == due:
+            if not self.repeat_after:
+                return None
+            repeat = datetime.fromtimestamp(sent[1]) + self.repeat_after
+            when = max(when, repeat)
+        return when
+
+    def _push(self, treeid: int, action: str, name: str, due: date):
+        key = (treeid, action)
+        when = None if due is None else self._when(key, due)
+        if when is None:
+            self.scheduled.pop(key, None)
+        elif self.scheduled.get(key) != when:
+            self.scheduled[key] = when
+            heapq.heappush(self.heap, (when, treeid, action, name))
+
+    def schedule(self, record: tuple):
+        r"""
+        Puts the events of a ``(histid, treeid, name, ...)`` record on the
+        heap. Entries replaced by a newer date stay in the heap but are skipped.
+        """
+        histid, treeid, name = record[:3]
+        values = dict(zip(bonsai_db.DATE_COLUMNS, record[3:]))
+        for column, action in bonsai_db.REMINDERS:
+            self._push(treeid, action, name, values[column])
+        self.last_histid = max(self.last_histid, histid)
+
+    def refresh(self):
+        r"""
+        Reschedules the trees written since the last refresh. Reading
+        ``data_version`` is a cheap check that skips the query if nothing
+        was committed by another connection.
+
+        :return: number of trees rescheduled.
+        """
+        version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+        if version == self.data_version:
+            return 0
+        self.data_version = version
+
+        changed = bonsai_db.load_changed(self.conn, self.last_histid)
+        for record in changed:
+            self.schedule(record)
+        return len(changed)
+
+    def pop_due(self, now: datetime):
+        r"""
+        Removes all events due at ``now`` from the heap. Before an event is
+        returned, the tree is looked up by its key, so deleted trees and
+        changed dates do not produce reminders. Fertilize reminders carry the
+        date the next fertilization moves to if the tree is fertilized today.
+
+        :return: list of reminder dictionaries.
+        """
+        reminders = []
+        while self.heap and self.heap[0][0] <= now:
+            when, treeid, action, name = heapq.heappop(self.heap)
+            key = (treeid, action)
+            if self.scheduled.get(key) != when:
+                continue
+            del self.scheduled[key]
+
+            record = bonsai_db.load_record(self.conn, treeid)
+            if record is None:
+                continue
+            values = dict(zip(bonsai_db.DATE_COLUMNS, record[2:]))
+            due = values[_ACTION_COLUMNS[action]]
+            if due is None or self._when(key, due) != when:
+                continue
+
+            reminder = {
+                "treeid": treeid,
+                "name": record[1],
+                "action": action,
+                "due": due.isoformat(),
+                "repeated": key in self.delivered,
+            }
+            if action == "fertilize":
+                reminder["next"] = next_fertilize(
+                    now.date(), values["last_repot"], species_of(record[1])
+                ).isoformat()
+            reminders.append(reminder)
+        return reminders
+
+    def digest(self, reminders: list, now: datetime):
+        r"""
+        Coalesces reminders into one message: the number of reminders per
+        action and the ``max_items`` earliest of them.
+
+        :return: digest dictionary.
+        """
+        reminders = sorted(reminders, key=lambda r: (r["due"], r["name"]))
+        actions = {}
+        for reminder in reminders:
+            action = reminder["action"]
+            actions[action] = actions.get(action, 0) + 1
+        return {
+            "sent": now.isoformat(timespec="seconds"),
+            "count": len(reminders),
+            "actions": actions,
+            "reminders": reminders[: self.max_items],
+            "more": max(len(reminders) - self.max_items, 0),
+        }
+
+    def deliver(self, now: datetime):
+        r"""
+        Sends the reminders due at ``now`` as one digest, unless the last
+        digest was sent less than ``digest_interval`` ago. Sent reminders are
+        stored with ``bonsai_database.mark_delivered`` and scheduled again for
+        their repetition. If the sink fails, they are retried after
+        ``check_interval``.
+
+        :return: number of reminders sent.
+        """
+        if now < self.next_digest:
+            return 0
+        reminders = self.pop_due(now)
+        if not reminders:
+            return 0
+
+        due = [
+            (r["treeid"], r["action"], r["name"], date.fromisoformat(r["due"]))
+            for r in reminders
+        ]
+        try:
+            self.sink.emit(self.digest(reminders, now))
+        except OSError as e:
+            print(e, file=sys.stderr)
+            for event in due:
+                self._push(*event)
+            self.next_digest = now + timedelta(seconds=self.check_interval)
+            return 0
+
+        sent_at = int(now.timestamp())
+        bonsai_db.mark_delivered(
+            self.conn, [(t, action, d) for t, action, _, d in due], sent_at
+        )
+        for treeid, action, name, due_date in due:
+            self.delivered[(treeid, action)] = (due_date, sent_at)
+            self._push(treeid, action, name, due_date)
+        self.next_digest = now + self.digest_interval
+        return len(reminders)
+
+    def next_wakeup(self, now: datetime):
+        r"""
+        :return: seconds until the next event may be sent or the next change
+            check.
+        """
+        timeout = self.check_interval
+        if self.heap:
+            when = max(self.heap[0][0], self.next_digest)
+            timeout = min(timeout, (when - now).total_seconds())
+        return max(timeout, 0.0)
+
+    def run(self):
+        r"""
+        Runs until :meth:`stop` is called. Between events the thread blocks on
+        an event object, so an idle daemon costs no CPU.
+        """
+        self._running = True
+        while self._running:
+            self.refresh()
+            self.deliver(datetime.now())
+            self._wake.wait(self.next_wakeup(datetime.now()))
+            self._wake.clear()
+
+    def notify(self):
+        r"""
+        Wakes the daemon to look for database changes right away.
+        """
+        self._wake.set()
+
+    def stop(self):
+        self._running = False
+        self._wake.set()
+
+
+# ------------------------------------------------------------------------------
+
+
+def main(argv=None):
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument(
+        "--db", default=os.path.join(base_dir, "db/bonsai_database.db")
+    )
+    parser.add_argument(
+        "--sink", default="stdout", help="stdout, file:PATH or socket:PATH"
+    )
+    parser.add_argument(
+        "--at", default="08:00", help="time of day reminders are sent"
+    )
+    parser.add_argument(
+        "--check-interval",
+        type=float,
+        default=60.0,
+        help="seconds between checks for database changes",
+    )
+    parser.add_argument(
+        "--digest-interval",
+        type=float,
+        default=3600.0,
+        help="seconds at least between two digests",
+    )
+    parser.add_argument(
+        "--repeat-days",
+        type=float,
+        default=3.0,
+        help="days until a reminder of an action not done is sent again,"
+        " 0 to send every reminder once",
+    )
+    parser.add_argument(
+        "--max-items",
+        type=int,
+        default=50,
+        help="reminders listed in a digest, the rest is only counted",
+    )
+    parser.add_argument(
+        "--once",
+        action="store_true",
+        help="send the reminders due now and exit",
+    )
+    args = parser.parse_args(argv)
+
+    sink = create_sink(args.sink)
+    with bonsai_db.database_connection(args.db) as db:
+        bonsai_db.initialize_table(db.conn)
+        daemon = reminder_daemon(
+            db.conn,
+            sink,
+            remind_at=time.fromisoformat(args.at),
+            check_interval=args.check_interval,
+            digest_interval=args.digest_interval,
+            repeat_after=timedelta(days=args.repeat_days) or None,
+            max_items=args.max_items,
+        )
+        if args.once:
+            daemon.refresh()
+            daemon.deliver(datetime.now())
+        else:
+            signal.signal(signal.SIGTERM, lambda *_: daemon.stop())
+            try:
+                daemon.run()
+            except KeyboardInterrupt:
+                pass
+    sink.close()
+
+
+if __name__ == "__main__":
+    main()
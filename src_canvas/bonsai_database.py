@@ -16,28 +16,154 @@ Collection of functions to maintain a small SQL database of the bonsai
 # TEXT
 # BLOB
 
+import bonsai_profiling
+import itertools
 import sqlite3
+import bonsai_dates
+import json
+import sys
+import os
 
+#: Version of the schema written by :func:`migrate`, stored in ``PRAGMA user_version``
+SCHEMA_VERSION = 7
 
-def create_connection(db_file: str):
+#: Columns of the latest-state table ``bonsai_current`` in the order returned by :func:`load_database`
+_COLUMNS = (
+    "treeid",
+    "name",
+    "next_fertilize",
+    "last_pruning",
+    "last_repot",
+    "last_wiring",
+)
+#: Action columns stored as integer day ordinals, NULL meaning "not yet"
+DATE_COLUMNS = _COLUMNS[2:]
+#: date columns that carry a due date and the action reminded of
+REMINDERS = (("next_fertilize", "fertilize"),)
+
+#: Name of the collection stored in the database a connection was opened on
+MAIN = "main"
+
+#: Appends a history row to a collection, ``saved_at`` is set to the current unix time
+#: and ``version`` to the version of the tree plus one
+_INSERT_INTO = f"""INSERT INTO {{0}}.bonsai
+    ({", ".join(_COLUMNS)}, saved_at, version)
+    SELECT ?1, ?2, ?3, ?4, ?5, ?6, CAST(strftime('%s', 'now') AS INTEGER),
+    IFNULL((SELECT version FROM {{0}}.bonsai_current WHERE treeid = ?1), 0)
+    + 1"""
+_INSERT = _INSERT_INTO.format(MAIN)
+
+
+#: Pragmas applied to every connection opened by :func:`create_connection`
+_PRAGMAS = (
+    ("journal_mode", "WAL"),
+    ("synchronous", "NORMAL"),
+    ("temp_store", "MEMORY"),
+)
+
+
+def create_connection(
+    db_file: str,
+    cache_size: int = -8000,
+    busy_timeout: int = 5000,
+    check_same_thread: bool = True,
+):
     """
-    Creates a connection to the bonsai database.
+    Creates a connection to the bonsai database. The connection runs in WAL
+    mode with ``synchronous=NORMAL``, so a commit costs no fsync of the main
+    file. ``cache_size`` follows the SQLite convention (negative values are
+    KiB), ``busy_timeout`` is given in milliseconds. Errors are raised.
+    Pass ``check_same_thread=False`` to hand the connection to another
+    thread; the caller then makes sure only one thread uses it at a time.
 
     :return: Connection object.
     """
 
-    conn = None
+    conn = sqlite3.connect(
+        db_file,
+        timeout=busy_timeout / 1000,
+        check_same_thread=check_same_thread,
+        factory=bonsai_profiling.connection_factory,
+    )
     try:
-        conn = sqlite3.connect(db_file)
-    except Exception as e:
-        print(e)
+        for pragma, value in _PRAGMAS:
+            conn.execute(f"PRAGMA {pragma} = {value}")
+        conn.execute(f"PRAGMA cache_size = {int(cache_size)}")
+        conn.execute(f"PRAGMA busy_timeout = {int(busy_timeout)}")
+    except sqlite3.Error:
+        conn.close()
+        raise
 
     return conn
 
 
-def initialize_table(conn):
+class database_connection:
     r"""
-    Initializes the database if not already existent
+    Owns the single long-lived connection of the app. The connection is opened
+    lazily on first use of ``conn`` and closed by :meth:`close` or when leaving
+    the ``with`` block:
+
+    .. code-block:: python
+
+        with database_connection("db/bonsai_database.db") as db:
+            bonsai_database.load_database(db.conn)
+    """
+
+    def __init__(
+        self,
+        db_file: str,
+        cache_size: int = -8000,
+        busy_timeout: int = 5000,
+        check_same_thread: bool = True,
+    ):
+        self.db_file = db_file
+        self.cache_size = cache_size
+        self.busy_timeout = busy_timeout
+        self.check_same_thread = check_same_thread
+        self._conn = None
+
+    @property
+    def conn(self):
+        r"""
+        The shared connection, opened on first access.
+        """
+        if self._conn is None:
+            self._conn = create_connection(
+                self.db_file,
+                self.cache_size,
+                self.busy_timeout,
+                self.check_same_thread,
+            )
+        return self._conn
+
+    def close(self):
+        r"""
+        Commits pending work, lets SQLite refresh its statistics and closes the
+        connection. Calling it twice is harmless.
+        """
+        if self._conn is None:
+            return
+        try:
+            self._conn.commit()
+            self._conn.execute("PRAGMA optimize")
+        finally:
+            self._conn.close()
+            self._conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None and self._conn is not None:
+            self._conn.rollback()
+        self.close()
+        return False
+
+
+def initialize_table(conn, samples: bool = True):
+    r"""
+    Initializes the database if not already existent. A new database gets a
+    few sample trees unless ``samples`` is False.
 
     :return: True
     """
@@ -50,6 +176,8 @@ def initialize_table(conn):
     ).fetchall()
 
     if listOfTables == []:
+        # an empty file can switch to incremental vacuum without VACUUM
+        cur.execute("PRAGMA auto_vacuum = INCREMENTAL")
         # create table
         cur.execute(
             """CREATE TABLE bonsai (
@@ -92,26 +220,474 @@ def initialize_table(conn):
             [5, "Old Ficus", "20.03.2023", "Not Yet", "Not Yet", "Not Yet"],
         ]
 
-        cur.executemany("INSERT INTO bonsai VALUES(?,?,?,?,?,?)", bonsai)
-    else:
-        pass
+        if samples:
+            cur.executemany("INSERT INTO bonsai VALUES(?,?,?,?,?,?)", bonsai)
+        conn.commit()
+
+    migrate(conn)
+    return True
+
+
+def migrate(conn):
+    r"""
+    Upgrades an existing database to ``SCHEMA_VERSION``. Each step in
+    ``_MIGRATIONS`` brings the schema one version further; all pending steps run
+    inside a single transaction so a failing upgrade leaves the file untouched.
+    The version is read again under the write lock, so of several instances
+    starting at once only one migrates.
+
+    :return: True if the schema was changed.
+    """
+    cur = conn.cursor()
+    version = cur.execute("PRAGMA user_version").fetchone()[0]
+    if version >= SCHEMA_VERSION:
+        return False
+
+    conn.create_function(
+        "text_to_ordinal", 1, bonsai_dates.text_to_ordinal, deterministic=True
+    )
+    if not conn.in_transaction:
+        cur.execute("BEGIN IMMEDIATE")
+    version = cur.execute("PRAGMA user_version").fetchone()[0]
+    if version >= SCHEMA_VERSION:
+        conn.commit()
+        return False
+    try:
+        # steps run without triggers, they are recreated for the final schema
+        cur.execute("DROP TRIGGER IF EXISTS bonsai_current_insert")
+        cur.execute("DROP TRIGGER IF EXISTS bonsai_current_delete")
+        for step in _MIGRATIONS[version:]:
+            step(cur)
+        _create_triggers(cur)
+        cur.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    except Exception:
+        conn.rollback()
+        raise
 
     conn.commit()
+    if version < 4:
+        _enable_incremental_vacuum(conn)
     return True
 
 
-def load_database(conn):
+def _upgrade_to_v1(cur):
+    r"""
+    Turns the plain append-only ``bonsai`` table into an indexed history table
+    with an explicit ``histid`` key and adds ``bonsai_current``, which holds
+    the latest row of every tree and is kept up to date by triggers.
+    """
+    cur.execute("ALTER TABLE bonsai RENAME TO bonsai_v0")
+    cur.execute(
+        """CREATE TABLE bonsai (
+        histid INTEGER PRIMARY KEY,
+        treeid INTEGER NOT NULL,
+        name TEXT,
+        next_fertilize TEXT,
+        last_pruning TEXT,
+        last_repot TEXT,
+        last_wiring TEXT
+    )"""
+    )
+    cur.execute(
+        """INSERT INTO bonsai SELECT rowid, * FROM bonsai_v0 ORDER BY rowid"""
+    )
+    cur.execute("DROP TABLE bonsai_v0")
+    cur.execute("CREATE INDEX bonsai_treeid ON bonsai (treeid, histid)")
+
+    cur.execute(
+        """CREATE TABLE bonsai_current (
+        treeid INTEGER PRIMARY KEY,
+        histid INTEGER NOT NULL,
+        name TEXT,
+        next_fertilize TEXT,
+        last_pruning TEXT,
+        last_repot TEXT,
+        last_wiring TEXT
+    )"""
+    )
+    cur.execute(
+        """INSERT INTO bonsai_current
+        SELECT treeid, histid, name, next_fertilize, last_pruning, last_repot,
+            last_wiring
+        FROM bonsai
+        WHERE histid IN (SELECT MAX(histid) FROM bonsai GROUP BY treeid)"""
+    )
+
+
+def _upgrade_to_v2(cur):
+    r"""
+    Converts the "dd.mm.YYYY"/"Not Yet" text dates of both tables into integer
+    day ordinals and NULL, and indexes the next fertilization date, so due
+    dates can be found with a range scan. Text that is no date becomes NULL as
+    well; these rows are reported on stderr.
+    """
+    dates = """text_to_ordinal(next_fertilize), text_to_ordinal(last_pruning),
+        text_to_ordinal(last_repot), text_to_ordinal(last_wiring)"""
+
+    # unparsable text becomes NULL, report the rows losing a value
+    for column in DATE_COLUMNS:
+        rows = cur.execute(
+            f"""SELECT histid, treeid, {column} FROM bonsai
+            WHERE {column} IS NOT NULL AND text_to_ordinal({column}) IS NULL"""
+        ).fetchall()
+        for histid, treeid, text in rows:
+            if str(text).strip() not in ("", bonsai_dates.NOT_YET):
+                print(
+                    f"tree {treeid}, history row {histid}: {column} '{text}'"
+                    " is no date, migrated as not set",
+                    file=sys.stderr,
+                )
+
+    cur.execute("ALTER TABLE bonsai RENAME TO bonsai_v1")
+    cur.execute(
+        """CREATE TABLE bonsai (
+        histid INTEGER PRIMARY KEY,
+        treeid INTEGER NOT NULL,
+        name TEXT,
+        next_fertilize INTEGER,
+        last_pruning INTEGER,
+        last_repot INTEGER,
+        last_wiring INTEGER
+    )"""
+    )
+    cur.execute(
+        f"""INSERT INTO bonsai
+        SELECT histid, treeid, name, {dates} FROM bonsai_v1"""
+    )
+    cur.execute("DROP TABLE bonsai_v1")
+    cur.execute("CREATE INDEX bonsai_treeid ON bonsai (treeid, histid)")
+
+    cur.execute("ALTER TABLE bonsai_current RENAME TO bonsai_current_v1")
+    cur.execute(
+        """CREATE TABLE bonsai_current (
+        treeid INTEGER PRIMARY KEY,
+        histid INTEGER NOT NULL,
+        name TEXT,
+        next_fertilize INTEGER,
+        last_pruning INTEGER,
+        last_repot INTEGER,
+        last_wiring INTEGER
+    )"""
+    )
+    cur.execute(
+        f"""INSERT INTO bonsai_current
+        SELECT treeid, histid, name, {dates} FROM bonsai_current_v1"""
+    )
+    cur.execute("DROP TABLE bonsai_current_v1")
+    cur.execute(
+        """CREATE INDEX bonsai_current_next_fertilize
+        ON bonsai_current (next_fertilize)"""
+    )
+
+
+def _upgrade_to_v3(cur):
+    r"""
+    Adds the ``info`` table holding the care notes of each tree as JSON and
+    imports the notes from the per-tree JSON files next to the database.
+    The files are left in place.
+    """
+    cur.execute(
+        """CREATE TABLE info (
+        treeid INTEGER PRIMARY KEY,
+        notes TEXT NOT NULL
+    )"""
+    )
+
+    db_file = ""
+    for _, schema, file_name in cur.execute("PRAGMA database_list"):
+        if schema == "main":
+            db_file = file_name
+    if not db_file:
+        return
+
+    directory = os.path.dirname(db_file)
+    trees = cur.execute("SELECT treeid, name FROM bonsai_current").fetchall()
+    for treeid, name in trees:
+        # bonsai.set_info replaced blanks, add_new_bonsai kept them
+        for file_name in (name.replace(" ", "_"), name):
+            path = os.path.join(directory, f"{file_name}.json")
+            if os.path.isfile(path):
+                with open(path, "r") as json_file:
+                    notes = json.load(json_file)
+                cur.execute(
+                    "INSERT OR REPLACE INTO info VALUES (?, ?)",
+                    (treeid, json.dumps(notes)),
+                )
+                break
+
+
+def _upgrade_to_v4(cur):
+    r"""
+    Adds the ``saved_at`` unix time to the history rows, so the history can be
+    pruned by age. Rows written before are NULL and count as oldest.
+    """
+    cur.execute("ALTER TABLE bonsai ADD COLUMN saved_at INTEGER")
+
+
+def _enable_incremental_vacuum(conn):
+    r"""
+    Switches the file to ``auto_vacuum = INCREMENTAL``, which lets
+    :func:`compact_history` return freed pages to the file system. An existing
+    file has to be rebuilt once with ``VACUUM``, which cannot run inside the
+    migration transaction.
+    """
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+        return
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("VACUUM")
+
+
+def _upgrade_to_v5(cur):
     r"""
-    Loads the latest records for each bonsai in the database
+    Adds the ``version`` of the trees for compare-and-swap saves, see
+    :func:`add_records`. Every history row gets the number of rows of its
+    tree up to and including itself.
+    """
+    cur.execute("ALTER TABLE bonsai ADD COLUMN version INTEGER")
+    cur.execute("ALTER TABLE bonsai_current ADD COLUMN version INTEGER")
+    cur.execute(
+        """CREATE TEMP TABLE numbered (
+        histid INTEGER PRIMARY KEY,
+        version INTEGER
+    )"""
+    )
+    cur.execute(
+        """INSERT INTO temp.numbered SELECT histid,
+        ROW_NUMBER() OVER (PARTITION BY treeid ORDER BY histid) FROM bonsai"""
+    )
+    for table in ("bonsai", "bonsai_current"):
+        cur.execute(
+            f"""UPDATE {table} SET version = (SELECT version
+            FROM temp.numbered WHERE histid = {table}.histid)"""
+        )
+    cur.execute("DROP TABLE temp.numbered")
+
+
+def _upgrade_to_v6(cur):
+    r"""
+    Adds ``delivered``, which remembers per tree and action the due date of
+    the last reminder sent and when it was sent, see :func:`mark_delivered`.
+    """
+    cur.execute(
+        """CREATE TABLE delivered (
+        treeid INTEGER NOT NULL,
+        action TEXT NOT NULL,
+        due INTEGER NOT NULL,
+        sent_at INTEGER NOT NULL,
+        PRIMARY KEY (treeid, action)
+    ) WITHOUT ROWID"""
+    )
+
+
+def _upgrade_to_v7(cur):
+    r"""
+    Rebuilds ``bonsai`` with an ``AUTOINCREMENT`` key. A plain ``INTEGER
+    PRIMARY KEY`` hands out the id of a deleted newest row again, so a tree
+    saved after deleting the last saved one got a ``histid`` already seen by
+    :func:`load_changed` readers and was missed by them.
+    """
+    cur.execute("ALTER TABLE bonsai RENAME TO bonsai_v6")
+    cur.execute(
+        """CREATE TABLE bonsai (
+        histid INTEGER PRIMARY KEY AUTOINCREMENT,
+        treeid INTEGER NOT NULL,
+        name TEXT,
+        next_fertilize INTEGER,
+        last_pruning INTEGER,
+        last_repot INTEGER,
+        last_wiring INTEGER,
+        saved_at INTEGER,
+        version INTEGER
+    )"""
+    )
+    cur.execute("INSERT INTO bonsai SELECT * FROM bonsai_v6 ORDER BY histid")
+    cur.execute("DROP TABLE bonsai_v6")
+    cur.execute("CREATE INDEX bonsai_treeid ON bonsai (treeid, histid)")
+
+
+_MIGRATIONS = (
+    _upgrade_to_v1,
+    _upgrade_to_v2,
+    _upgrade_to_v3,
+    _upgrade_to_v4,
+    _upgrade_to_v5,
+    _upgrade_to_v6,
+    _upgrade_to_v7,
+)
+
+
+def _create_triggers(cur):
+    r"""
+    (Re)creates the triggers mirroring the newest history row of each tree into
+    ``bonsai_current``. Deleting the current row falls back to the next older
+    one, so pruning history never loses the latest state.
+    """
+    columns = ", ".join(("histid",) + _COLUMNS + ("version",))
+    new_values = ", ".join(
+        f"NEW.{col}" for col in ("histid",) + _COLUMNS + ("version",)
+    )
+
+    cur.execute("DROP TRIGGER IF EXISTS bonsai_current_insert")
+    cur.execute(
+        f"""CREATE TRIGGER bonsai_current_insert AFTER INSERT ON bonsai
+        WHEN NEW.histid >= IFNULL(
+            (SELECT histid FROM bonsai_current WHERE treeid = NEW.treeid),
+            NEW.histid)
+        BEGIN
+            INSERT OR REPLACE INTO bonsai_current ({columns})
+            VALUES ({new_values});
+        END"""
+    )
+
+    cur.execute("DROP TRIGGER IF EXISTS bonsai_current_delete")
+    cur.execute(
+        f"""CREATE TRIGGER bonsai_current_delete AFTER DELETE ON bonsai
+        WHEN OLD.histid =
+            (SELECT histid FROM bonsai_current WHERE treeid = OLD.treeid)
+        BEGIN
+            DELETE FROM bonsai_current WHERE treeid = OLD.treeid;
+            INSERT INTO bonsai_current ({columns})
+            SELECT {columns} FROM bonsai WHERE treeid = OLD.treeid
+            ORDER BY histid DESC LIMIT 1;
+        END"""
+    )
+
+
+def load_database(conn, versions: bool = False):
+    r"""
+    Loads the latest records for each bonsai in the database. These are kept in
+    ``bonsai_current``, so the history does not have to be scanned. With
+    ``versions``, every record is prefixed by the version of the tree, which
+    :func:`add_records` expects back.
 
     :return: list of tuples containing the attributes of each instance of the bonsai class
     """
     cur = conn.cursor()
+    if versions:
+        table = cur.execute(
+            f"""SELECT version, {", ".join(_COLUMNS)} FROM bonsai_current
+            ORDER BY treeid;"""
+        )
+        return [row[:1] + _from_row(row[1:]) for row in table]
+
     table = cur.execute(
-        """SELECT * FROM (SELECT * from bonsai ORDER BY rowid DESC) GROUP BY treeid;"""
-    ).fetchall()
+        f"""SELECT {", ".join(_COLUMNS)} FROM bonsai_current ORDER BY treeid;"""
+    )
+
+    return [_from_row(row) for row in table]
+
+
+def load_record(conn, treeid: int):
+    r"""
+    Loads the latest record of a single tree by its primary key.
+
+    :return: tuple like :func:`load_database` or None if the tree does not exist.
+    """
+    cur = conn.cursor()
+    row = cur.execute(
+        f"""SELECT {", ".join(_COLUMNS)} FROM bonsai_current
+        WHERE treeid = ?;""",
+        (treeid,),
+    ).fetchone()
+
+    return None if row is None else _from_row(row)
+
+
+def load_changed(conn, since: int = 0):
+    r"""
+    Loads the latest records written after the history row ``since``. Passing
+    the largest ``histid`` seen so far returns only trees changed since then;
+    history ids are never handed out twice, even after deletes.
+
+    :return: list of tuples ``(histid, treeid, name, ...)``.
+    """
+    cur = conn.cursor()
+    table = cur.execute(
+        f"""SELECT histid, {", ".join(_COLUMNS)} FROM bonsai_current
+        WHERE histid > ? ORDER BY histid;""",
+        (since,),
+    )
+
+    return [row[:1] + _from_row(row[1:]) for row in table]
+
+
+def load_due(
+    conn, until, action: str = "next_fertilize", collections: bool = False
+):
+    r"""
+    Loads the latest records whose date of ``action`` lies before ``until``,
+    earliest first. Uses an index range scan for ``next_fertilize``. With
+    ``collections``, all collections attached by :func:`attach_collections`
+    are searched in one query; the range scans of the collections are merged.
+
+    :return: list of tuples like :func:`load_database`, prefixed by the
+        collection with ``collections``.
+    """
+    if action not in DATE_COLUMNS:
+        raise ValueError(f"unknown action column '{action}'")
+
+    cur = conn.cursor()
+    if collections:
+        table = cur.execute(
+            f"""SELECT collection, {", ".join(_COLUMNS)}
+            FROM collection_current WHERE {action} < ? ORDER BY {action};""",
+            (bonsai_dates.to_ordinal(until),),
+        )
+        return [row[:1] + _from_row(row[1:]) for row in table]
+
+    table = cur.execute(
+        f"""SELECT {", ".join(_COLUMNS)} FROM bonsai_current
+        WHERE {action} < ? ORDER BY {action};""",
+        (bonsai_dates.to_ordinal(until),),
+    )
+
+    return [_from_row(row) for row in table]
+
+
+def iter_records(conn, history: bool = False, batch: int = 1000):
+    r"""
+    Streams the latest records ordered by ``treeid``, or with ``history``
+    every history row ordered by tree and age. Rows are fetched ``batch`` at a
+    time, so the table is never held in memory.
+
+    :return: generator of tuples like :func:`load_database`; history rows are
+        prefixed by ``histid`` and ``saved_at``.
+    """
+    columns = ", ".join(_COLUMNS)
+    if history:
+        sql = f"""SELECT histid, saved_at, {columns} FROM bonsai
+            ORDER BY treeid, histid"""
+    else:
+        sql = f"SELECT {columns} FROM bonsai_current ORDER BY treeid"
+
+    cur = conn.execute(sql)
+    while True:
+        rows = cur.fetchmany(batch)
+        if not rows:
+            return
+        for row in rows:
+            if history:
+                yield row[:2] + _from_row(row[2:])
+            else:
+                yield _from_row(row)
+
+
+def _from_row(row):
+    r"""
+    Converts the stored day ordinals of a row back into date objects.
+    """
+    from_ordinal = bonsai_dates.from_ordinal
+    return row[:2] + tuple(from_ordinal(value) for value in row[2:])
 
-    return table
+
+def _record_values(record):
+    r"""
+    Converts a bonsai instance into the tuple of values stored per history row.
+    """
+    to_ordinal = bonsai_dates.to_ordinal
+    return (record.treeid, record.name) + tuple(
+        to_ordinal(getattr(record, col)) for col in DATE_COLUMNS
+    )
 
 
 # add record defines as tuple
@@ -121,33 +697,448 @@ def add_record(conn, new_record):
 
     :return: True
     """
-    sql = "INSERT INTO bonsai VALUES(?,?,?,?,?,?)"
-    new_record = [
-        new_record.treeid,
-        new_record.name,
-        new_record.next_fertilize,
-        new_record.last_pruning,
-        new_record.last_repot,
-        new_record.last_wiring,
-    ]
     cur = conn.cursor()
-    cur.execute(sql, new_record)
+    cur.execute(_INSERT, _record_values(new_record))
 
     conn.commit()
     return True
 
 
+class version_conflict(Exception):
+    r"""
+    Raised by :func:`add_records` if trees were saved or deleted by another
+    connection since they were loaded. ``conflicts`` maps the
+    ``(collection, treeid)`` of these trees to their version in the database,
+    None for deleted trees.
+    """
+
+    def __init__(self, conflicts: dict):
+        self.conflicts = conflicts
+        super().__init__(
+            f"{len(conflicts)} trees were changed by another writer: "
+            + ", ".join(f"{c}/{t}" for c, t in sorted(conflicts))
+        )
+
+
+def _versions(conn, schema: str, treeids):
+    r"""
+    :return: dictionary treeid -> version of the stored trees of ``treeids``.
+    """
+    treeids = list(treeids)
+    versions = {}
+    for start in range(0, len(treeids), 500):
+        chunk = treeids[start : start + 500]
+        versions.update(
+            conn.execute(
+                f"""SELECT treeid, version FROM {schema}.bonsai_current
+                WHERE treeid IN ({", ".join("?" * len(chunk))});""",
+                chunk,
+            )
+        )
+    return versions
+
+
+def add_records(conn, new_records, removed_records=(), notes=None):
+    r"""
+    Adds many records with a single ``executemany`` per collection inside one
+    transaction. The history of ``removed_records`` is deleted first, in the
+    same transaction. If any row fails, the whole batch is rolled back. Every
+    record is written to the database of its ``collection``. ``notes`` maps
+    ``(collection, treeid)`` to care notes stored in the same transaction,
+    e.g. the notes of new trees, see :func:`save_info`.
+
+    Saves are compare-and-swap: every record carries the ``version`` of the
+    tree it was loaded with, None for new trees. The transaction takes the
+    write lock up front and checks these versions first; if another
+    connection saved or deleted any of the trees in the meantime, nothing is
+    written and :class:`version_conflict` is raised. A written tree gets the
+    version ``version + 1``.
+
+    :return: number of rows written.
+    """
+    groups = {}  # collection -> (rows, removed, expected versions)
+    for records, index in ((new_records, 0), (removed_records, 1)):
+        for record in records:
+            collection = getattr(record, "collection", MAIN)
+            group = groups.setdefault(collection, ([], [], {}))
+            if index == 0:
+                group[0].append(_record_values(record))
+            else:
+                group[1].append((record.treeid,))
+            group[2][record.treeid] = getattr(record, "version", None)
+    notes = notes or {}
+    if not groups and not notes:
+        return 0
+
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conflicts = {}
+        for collection, (_, _, expected) in groups.items():
+            stored = _versions(conn, _schema(collection), expected)
+            for treeid, version in expected.items():
+                if stored.get(treeid) != version:
+                    conflicts[(collection, treeid)] = stored.get(treeid)
+        if conflicts:
+            raise version_conflict(conflicts)
+
+        for collection, (rows, removed, _) in groups.items():
+            schema = _schema(collection)
+            conn.executemany(
+                f"DELETE from {schema}.info WHERE treeid = ?", removed
+            )
+            conn.executemany(
+                f"DELETE from {schema}.delivered WHERE treeid = ?", removed
+            )
+            conn.executemany(
+                f"DELETE from {schema}.bonsai_current WHERE treeid = ?",
+                removed,
+            )
+            conn.executemany(
+                f"DELETE from {schema}.bonsai WHERE treeid = ?", removed
+            )
+            conn.executemany(_INSERT_INTO.format(schema), rows)
+        for (collection, treeid), value in notes.items():
+            conn.execute(
+                f"INSERT OR REPLACE INTO {_schema(collection)}.info "
+                "VALUES (?, ?)",
+                (treeid, json.dumps(value)),
+            )
+    except Exception:
+        conn.rollback()
+        raise
+    conn.commit()
+
+    return sum(len(rows) for rows, _, _ in groups.values())
+
+
+def import_records(
+    conn,
+    records,
+    chunk_size: int = 5000,
+    keep_ids: bool = False,
+    renumbered=None,
+):
+    r"""
+    Appends a stream of records ``(treeid, name, next_fertilize, ...)`` with
+    date objects in transactions of ``chunk_size`` rows. Only one chunk is
+    held in memory. Every record gets a new ``treeid`` unless ``keep_ids`` is
+    set, then only records without one. The ids are allocated as one block per
+    chunk inside its write transaction, so concurrent writers cannot take the
+    same ids. With ``keep_ids``, records of the same id are stored as versions
+    of one tree. An id belonging to a tree stored before the import is not
+    merged into that tree: its records get a new id, which is reported to
+    ``renumbered(treeid, new_treeid)``.
+
+    :return: number of records written.
+    """
+    written = 0
+    records = iter(records)
+    first_new = None  # ids from here on did not exist before the import
+    imported = set()  # ids below first_new written by this import
+    new_ids = {}  # ids of stored trees -> new id of their records
+    while True:
+        chunk = list(itertools.islice(records, chunk_size))
+        if not chunk:
+            return written
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            next_id = conn.execute(
+                "SELECT IFNULL(MAX(treeid) + 1, 0) FROM bonsai"
+            ).fetchone()[0]
+            if keep_ids:
+                if first_new is None:
+                    first_new = next_id
+                ids = {
+                    r[0]
+                    for r in chunk
+                    if r[0] is not None
+                    and r[0] < first_new
+                    and r[0] not in imported
+                    and r[0] not in new_ids
+                }
+                taken = _versions(conn, MAIN, ids)
+                imported.update(ids.difference(taken))
+                next_id = max(
+                    [next_id] + [r[0] + 1 for r in chunk if r[0] is not None]
+                )
+                for treeid in sorted(taken):
+                    new_ids[treeid], next_id = next_id, next_id + 1
+                    if renumbered is not None:
+                        renumbered(treeid, new_ids[treeid])
+            rows = []
+            for record in chunk:
+                treeid = record[0] if keep_ids else None
+                if treeid is None:
+                    treeid, next_id = next_id, next_id + 1
+                treeid = new_ids.get(treeid, treeid)
+                rows.append(
+                    (treeid, record[1])
+                    + tuple(map(bonsai_dates.to_ordinal, record[2:]))
+                )
+            conn.executemany(_INSERT, rows)
+        except Exception:
+            conn.rollback()
+            raise
+        conn.commit()
+        written += len(rows)
+
+
 # remove record
 def remove_record(conn, remove_record):
     r"""
-    Removes a record to the database
+    Removes a record, its history, its care notes and its sent reminders from
+    the database. All deletes use the ``treeid`` keys, dropping the current
+    row first keeps the trigger idle.
 
     :return: True
     """
-    sql = "DELETE from bonsai WHERE treeid = ?"
-
     cur = conn.cursor()
-    cur.execute(sql, (remove_record.treeid,))
+    cur.execute("DELETE from info WHERE treeid = ?", (remove_record.treeid,))
+    cur.execute(
+        "DELETE from delivered WHERE treeid = ?", (remove_record.treeid,)
+    )
+    cur.execute(
+        "DELETE from bonsai_current WHERE treeid = ?", (remove_record.treeid,)
+    )
+    cur.execute(
+        "DELETE from bonsai WHERE treeid = ?", (remove_record.treeid,)
+    )
 
     conn.commit()
     return True
+
+
+def load_info(conn, treeids, collection=MAIN):
+    r"""
+    Loads the care notes of the given trees of ``collection``.
+
+    :return: dictionary treeid -> notes, trees without notes are left out.
+    """
+    treeids = list(treeids)
+    schema = _schema(collection)
+    cur = conn.cursor()
+    notes = {}
+    # stay below SQLite's limit of host parameters per statement
+    for start in range(0, len(treeids), 500):
+        chunk = treeids[start : start + 500]
+        rows = cur.execute(
+            f"""SELECT treeid, notes FROM {schema}.info
+            WHERE treeid IN ({", ".join("?" * len(chunk))});""",
+            chunk,
+        )
+        notes.update((treeid, json.loads(text)) for treeid, text in rows)
+
+    return notes
+
+
+def save_info(conn, treeid: int, notes: dict, collection=MAIN):
+    r"""
+    Stores the care notes of a tree of ``collection``, replacing the previous
+    ones.
+
+    :return: True
+    """
+    with conn:
+        conn.execute(
+            f"INSERT OR REPLACE INTO {_schema(collection)}.info VALUES (?, ?)",
+            (treeid, json.dumps(notes)),
+        )
+    return True
+
+
+def load_delivered(conn):
+    r"""
+    Loads the reminders sent so far, see :func:`mark_delivered`.
+
+    :return: dictionary ``(treeid, action) -> (due, sent_at)`` with the due
+        date as date and ``sent_at`` as unix time.
+    """
+    return {
+        (treeid, action): (bonsai_dates.from_ordinal(due), sent_at)
+        for treeid, action, due, sent_at in conn.execute(
+            "SELECT treeid, action, due, sent_at FROM delivered"
+        )
+    }
+
+
+def mark_delivered(conn, reminders, sent_at: int):
+    r"""
+    Records in one transaction that reminders of ``(treeid, action, due)``
+    were sent at the unix time ``sent_at``, replacing the previous reminder of
+    the same tree and action.
+
+    :return: True
+    """
+    with conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO delivered VALUES (?, ?, ?, ?)",
+            (
+                (treeid, action, bonsai_dates.to_ordinal(due), sent_at)
+                for treeid, action, due in reminders
+            ),
+        )
+    return True
+
+
+# --------------------------------COLLECTIONS-----------------------------------
+def _schema(collection: str):
+    r"""
+    :return: the quoted schema name of a collection for use in SQL.
+    """
+    if not collection.isidentifier():
+        raise ValueError(f"invalid collection name '{collection}'")
+    return f'"{collection}"'
+
+
+def collection_names(conn):
+    r"""
+    :return: list of the collections of ``conn``, ``main`` first.
+    """
+    return [
+        name
+        for _, name, _ in conn.execute("PRAGMA database_list")
+        if name != "temp"
+    ]
+
+
+def attach_collections(conn, collections: dict):
+    r"""
+    Attaches the databases of further collections, given as a dictionary
+    name -> file, to ``conn`` and (re)creates the temporary view
+    ``collection_current``: ``bonsai_current`` of all collections with the
+    name of the collection in the column ``collection``. Queries on the view
+    are planned once for all collections; conditions on indexed columns are
+    pushed down into each of them. Files are created without sample trees
+    and migrated by :func:`initialize_table` before they are attached. The
+    database ``conn`` was opened on is the collection ``main``.
+
+    :return: list of the collection names, ``main`` first.
+    """
+    attached = collection_names(conn)
+    for name, db_file in collections.items():
+        schema = _schema(name)
+        if name.lower() in (MAIN, "temp"):
+            raise ValueError(f"'{name}' is reserved for the main collection")
+        if name in attached:
+            continue
+        other = create_connection(db_file)
+        try:
+            initialize_table(other, samples=False)
+        finally:
+            other.close()
+        conn.execute(f"ATTACH DATABASE ? AS {schema}", (db_file,))
+
+    names = collection_names(conn)
+    columns = ", ".join(("histid", "version") + _COLUMNS)
+    conn.execute("DROP VIEW IF EXISTS temp.collection_current")
+    conn.execute(
+        "CREATE TEMP VIEW collection_current AS "
+        + " UNION ALL ".join(
+            f"SELECT '{name}' AS collection, {columns}"
+            f" FROM {_schema(name)}.bonsai_current"
+            for name in names
+        )
+    )
+    return names
+
+
+def load_collections(conn):
+    r"""
+    Loads the latest records of all collections attached by
+    :func:`attach_collections` with one query on ``collection_current``.
+
+    :return: list of tuples like :func:`load_database` prefixed by the
+        collection and the version of the tree, ordered by collection and
+        ``treeid``.
+    """
+    cur = conn.cursor()
+    table = cur.execute(
+        f"""SELECT collection, version, {", ".join(_COLUMNS)}
+        FROM collection_current ORDER BY collection, treeid;"""
+    )
+
+    return [row[:2] + _from_row(row[2:]) for row in table]
+
+
+# ---------------------------------COMPACTION-----------------------------------
+def compact_history(
+    conn,
+    keep_versions: int = None,
+    keep_since: int = None,
+    batch_rows: int = 1000,
+    vacuum_pages: int = 256,
+):
+    r"""
+    Prunes the history of all trees. A history row is kept if it is one of
+    the ``keep_versions`` newest rows of its tree or was saved at or after
+    the unix time ``keep_since``; rows without ``saved_at`` count as older
+    than any cutoff. Without any limit nothing is removed. The newest row of
+    each tree is always kept.
+
+    Rows are deleted in transactions of at most ``batch_rows`` rows, so the
+    write lock is only held briefly and the app can save in between.
+    Afterwards the freed pages are returned to the file system with
+    ``PRAGMA incremental_vacuum``, ``vacuum_pages`` pages per transaction.
+
+    :return: dictionary with the number of ``rows_removed``, the
+        ``bytes_reclaimed`` and the number of delete ``batches``.
+    """
+    if keep_versions is None and keep_since is None:
+        return {"rows_removed": 0, "bytes_reclaimed": 0, "batches": 0}
+    keep_versions = max(keep_versions or 1, 1)
+    keep_since = float("inf") if keep_since is None else keep_since
+
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    pages_before = conn.execute("PRAGMA page_count").fetchone()[0]
+
+    # the (treeid, histid) index delivers the versions of each tree in order
+    select = """SELECT histid FROM (
+            SELECT histid, saved_at, ROW_NUMBER() OVER (
+                PARTITION BY treeid ORDER BY histid DESC) AS version
+            FROM bonsai WHERE treeid > ? AND treeid <= ?)
+        WHERE version > ? AND IFNULL(saved_at < ?, 1)"""
+    removed = batches = 0
+    low = -(2**63)
+    while True:
+        # trees are visited in key ranges of about one batch of rows
+        upper = conn.execute(
+            """SELECT treeid FROM bonsai_current WHERE treeid > ?
+            ORDER BY treeid LIMIT 1 OFFSET ?""",
+            (low, max(batch_rows // (keep_versions + 1), 1) - 1),
+        ).fetchone()
+        high = 2**63 - 1 if upper is None else upper[0]
+        histids = conn.execute(
+            select, (low, high, keep_versions, keep_since)
+        ).fetchall()
+        for start in range(0, len(histids), batch_rows):
+            with conn:
+                conn.executemany(
+                    "DELETE FROM bonsai WHERE histid = ?",
+                    histids[start : start + batch_rows],
+                )
+            batches += 1
+        removed += len(histids)
+        if upper is None:
+            break
+        low = high
+
+    # hand the free pages back in small steps, stepping the pragma to the end
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+        while conn.execute("PRAGMA freelist_count").fetchone()[0]:
+            with conn:
+                conn.execute(
+                    f"PRAGMA incremental_vacuum({int(vacuum_pages)})"
+                ).fetchall()
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+
+    pages_after = conn.execute("PRAGMA page_count").fetchone()[0]
+    return {
+        "rows_removed": removed,
+        "bytes_reclaimed": (pages_before - pages_after) * page_size,
+        "batches": batches,
+    }
+
+
+# time every function with BONSAI_PROFILE=1, see bonsai_profiling
+bonsai_profiling.instrument(globals(), "db")
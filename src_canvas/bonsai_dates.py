@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Author: Viktor Pfaffenrot
+
+
+Date codec shared by the database layer and the GUI. Inside the app, action
+dates are ``datetime.date`` objects or None if the action did not happen yet.
+The database stores them as integer day ordinals (NULL for "not yet"), the
+GUI shows them as "dd.mm.YYYY" strings or "Not Yet".
+"""
+
+from datetime import date
+from functools import lru_cache
+
+DATE_FORMAT = "%d.%m.%Y"  #: format shown in the entry fields
+NOT_YET = "Not Yet"  #: text shown for dates that are not set
+
+
+@lru_cache(maxsize=4096)
+def parse_date(text: str):
+    r"""
+    Parses a "dd.mm.YYYY" string. Splitting by hand is several times faster
+    than ``datetime.strptime`` and repeated values are served from the cache.
+
+    :return: date object or None for "Not Yet" and empty strings.
+    :raises ValueError: if the text is not a valid date.
+    """
+    text = text.strip()
+    if text == "" or text == NOT_YET:
+        return None
+    try:
+        day, month, year = text.split(".")
+        return date(int(year), int(month), int(day))
+    except (ValueError, TypeError):
+        raise ValueError(f"'{text}' is not a date of the form dd.mm.YYYY")
+
+
+@lru_cache(maxsize=4096)
+def format_date(day):
+    r"""
+    :return: "dd.mm.YYYY" string or "Not Yet" if day is None.
+    """
+    if day is None:
+        return NOT_YET
+    return f"{day.day:02d}.{day.month:02d}.{day.year:04d}"
+
+
+def to_ordinal(day):
+    r"""
+    :return: the proleptic Gregorian ordinal stored in the database or None.
+    """
+    if day is None:
+        return None
+    return day.toordinal()
+
+
+def from_ordinal(ordinal):
+    r"""
+    :return: date object of a stored ordinal or None.
+    """
+    if ordinal is None:
+        return None
+    return date.fromordinal(ordinal)
+
+
+def text_to_ordinal(text):
+    r"""
+    Converts the legacy text representation into an ordinal. Used by the
+    database migration, so unparsable values become None instead of raising.
+    """
+    if text is None:
+        return None
+    try:
+        return to_ordinal(parse_date(str(text)))
+    except ValueError:
+        return None
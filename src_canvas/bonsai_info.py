@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Author: Viktor Pfaffenrot
+
+
+Access to the care notes of the trees. The notes are stored in the ``info``
+table of the bonsai database as a dictionary of the form
+``{action: [points]}``. Parsed notes are kept in a small LRU cache, and the
+notes of the trees next to the shown one are loaded in the background, so
+the info window opens without touching the disk.
+
+:class:`info_document` converts the notes to the text shown in the info
+window and back.
+"""
+
+from collections import OrderedDict
+import bonsai_database as bonsai_db
+import threading
+import queue
+import re
+
+_MISSING = object()  # cached marker for trees without notes
+
+#: notes shown for a tree without notes
+PLACEHOLDER = {
+    action: ["", "", ""] for action in ("Repot", "Pruning", "Wiring")
+}
+
+_HEADER = re.compile(r"^.*:.*$", re.M)  # a line with a colon starts a section
+_EMPTY_LINES = re.compile(r"\n\n+")
+
+
+class info_store:
+    r"""
+    LRU cache of parsed care notes in front of ``bonsai_database``, keyed by
+    the ``key`` ``(collection, treeid)`` of the trees. Reads and writes of the
+    app use ``conn``; prefetching runs in a daemon thread with a connection of
+    its own to ``db_file``, which WAL mode allows next to the main
+    connection. It attaches the same ``collections`` as the app, see
+    ``bonsai_database.attach_collections``.
+
+    .. automethod:: get
+    .. automethod:: save
+    .. automethod:: put
+    .. automethod:: prefetch
+    """
+
+    def __init__(
+        self,
+        conn,
+        db_file: str = None,
+        capacity: int = 64,
+        collections: dict = None,
+    ):
+        self.conn = conn
+        self.db_file = db_file
+        self.collections = collections or {}
+        self.capacity = capacity
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._requests = queue.Queue()
+        self._thread = None
+
+    def _put(self, key: tuple, notes, replace: bool = True):
+        with self._lock:
+            if not replace and key in self._cache:
+                return
+            self._cache[key] = notes
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.capacity:
+                self._cache.popitem(last=False)
+
+    def _cached(self, key: tuple):
+        with self._lock:
+            notes = self._cache.get(key)
+            if notes is not None:
+                self._cache.move_to_end(key)
+            return notes
+
+    def get(self, key: tuple):
+        r"""
+        :return: notes of the tree or None if it has none.
+        """
+        notes = self._cached(key)
+        if notes is None:
+            collection, treeid = key
+            notes = bonsai_db.load_info(self.conn, (treeid,), collection).get(
+                treeid, _MISSING
+            )
+            self._put(key, notes)
+        return None if notes is _MISSING else notes
+
+    def save(self, key: tuple, notes: dict):
+        r"""
+        Writes the notes of a tree and updates the cache.
+        """
+        collection, treeid = key
+        bonsai_db.save_info(self.conn, treeid, notes, collection)
+        self._put(key, notes)
+
+    def put(self, key: tuple, notes: dict):
+        r"""
+        Updates the cache without writing, for notes that are stored later
+        together with their tree.
+        """
+        self._put(key, notes)
+
+    def move(self, key: tuple, new_key: tuple):
+        r"""
+        Moves the cached notes of a tree that got a new ``key``.
+        """
+        with self._lock:
+            notes = self._cache.pop(key, None)
+            if notes is not None:
+                self._cache[new_key] = notes
+
+    def discard(self, key: tuple):
+        with self._lock:
+            self._cache.pop(key, None)
+
+    def prefetch(self, keys):
+        r"""
+        Queues the notes of the trees of ``keys`` for loading in the
+        background. Trees already in the cache are skipped.
+        """
+        if self.db_file in (None, "", ":memory:"):
+            return
+        with self._lock:
+            missing = [key for key in keys if key not in self._cache]
+        if not missing:
+            return
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._prefetch_worker, daemon=True
+            )
+            self._thread.start()
+        self._requests.put(missing)
+
+    def _prefetch_worker(self):
+        conn = bonsai_db.create_connection(self.db_file)
+        try:
+            if self.collections:
+                bonsai_db.attach_collections(conn, self.collections)
+            while True:
+                keys = self._requests.get()
+                if keys is None:
+                    break
+                groups = {}
+                for collection, treeid in keys:
+                    groups.setdefault(collection, []).append(treeid)
+                for collection, treeids in groups.items():
+                    notes = bonsai_db.load_info(conn, treeids, collection)
+                    for treeid in treeids:
+                        # a save in the meantime is newer than what was read
+                        self._put(
+                            (collection, treeid),
+                            notes.get(treeid, _MISSING),
+                            replace=False,
+                        )
+        finally:
+            conn.close()
+
+    def close(self):
+        r"""
+        Stops the prefetch thread.
+        """
+        if self._thread is not None:
+            self._requests.put(None)
+            self._thread.join()
+            self._thread = None
+
+
+# -----------------------------------DOCUMENT-----------------------------------
+def render_lines(notes: dict):
+    r"""
+    :return: the lines of the info text: a line ``action:`` per section
+        followed by one bullet point and an empty line per point.
+    """
+    lines = []
+    for action, points in notes.items():
+        lines.append(f"{action}:")
+        for point in points:
+            lines.append(f"    • {point}")
+            lines.append("")
+    return lines
+
+
+def _parse_point(line: str):
+    return line.strip().strip("• ").replace("*", "")
+
+
+def _parse_section(block: str):
+    lines = block.split("\n")
+    action = lines[0].strip(":")
+    # a point line reading like the section name does not close the section
+    closed = any(line.strip(":") != action for line in lines[1:])
+    return action, tuple(map(_parse_point, lines[1:])), closed
+
+
+class info_document:
+    r"""
+    The info text of one tree. The text is handed out in chunks of
+    ``chunk`` lines by :meth:`next_chunk`, so a long care log is only
+    rendered as far as it is scrolled. :meth:`parse` converts the edited text
+    back to notes. Sections are cached by their text, so only sections that
+    were edited are parsed again.
+
+    Lines containing a colon start a section, lines before the first section
+    and empty lines are ignored, ``*`` and the bullets are removed from the
+    points. Sections without a name and a trailing section without points
+    are dropped, as are sections without points directly followed by one of
+    the same name.
+
+    .. automethod:: next_chunk
+    .. automethod:: parse
+    """
+
+    def __init__(self, notes: dict = None, chunk: int = 400):
+        self.notes = PLACEHOLDER if notes is None else notes
+        self.chunk = chunk
+        self.lines = render_lines(self.notes)
+        self.shown = 0  #: number of lines handed out so far
+        self._sections = {}
+
+        # sections read back unchanged need no parsing
+        for action, points in self.notes.items():
+            lines = [f"{action}:"] + [f"    • {point}" for point in points]
+            exact = lines[0].strip(":") == action and all(
+                "\n" not in point and _parse_point(line) == point
+                for line, point in zip(lines[1:], points)
+            )
+            if exact:
+                closed = any(line.strip(":") != action for line in lines[1:])
+                self._sections["\n".join(lines)] = (
+                    action,
+                    tuple(points),
+                    closed,
+                )
+
+    def remaining(self):
+        return len(self.lines) - self.shown
+
+    def next_chunk(self):
+        r"""
+        :return: the text of the next lines, an empty string at the end.
+        """
+        if not self.remaining():
+            return ""
+        end = min(self.shown + self.chunk, len(self.lines))
+        text = "\n".join(self.lines[self.shown : end]) + "\n"
+        self.shown = end
+        return text
+
+    def parse(self, text: str):
+        r"""
+        Converts the shown text, followed by the lines not shown yet, to
+        notes.
+
+        :return: dictionary ``{action: [points]}``.
+        """
+        if self.remaining():
+            text += "\n".join(self.lines[self.shown :]) + "\n"
+        text = text.strip()
+
+        starts = [match.start() for match in _HEADER.finditer(text)]
+        sections = []
+        for start, end in zip(starts, starts[1:] + [len(text)]):
+            block = _EMPTY_LINES.sub("\n", text[start:end]).strip("\n")
+            section = self._sections.get(block)
+            if section is None:
+                section = self._sections[block] = _parse_section(block)
+            sections.append(section)
+
+        notes = {}
+        for ii, (action, points, closed) in enumerate(sections):
+            # a section is kept once a line of another name follows its name
+            if not closed and ii + 1 < len(sections):
+                closed = sections[ii + 1][0] != action
+            if action and closed:
+                notes[action] = list(points)
+        return notes
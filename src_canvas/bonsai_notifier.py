@@ -11,30 +11,75 @@ displays some basic infos.
 
 All but fertilizing can be set to today's date by clicking on the left plus
 button. In case of fertilization, the next fertilization date will be set when
-clicking the plus button. The date is determined according to the tree's
-fertilization schedule (typically every two months in the growing season).
+clicking the plus button. The date is determined according to the
+fertilization schedule of the tree's species (typically every two months in
+the growing season).
 All dates can be manually set by entering the corresponding fields.
+A right click on the fertilization plus button plans the next fertilization
+of all trees at once and saves them.
 
 New bonsai can be added by clicking on 'Add Bonsai'. This prompts to another
 field asking for the name and the purchase date of the new tree. Specific infos
-can be parsed by clicking on 'Fill Info'. When saving, a json file is created
-for the specific tree. Before filling, submit the tree to the database.
+can be parsed by clicking on 'Fill Info' once the tree is submitted. The notes
+of a new tree are kept with it and stored in the database together with the
+tree by the next 'Save Changes'.
+
+Clicking on the name of the tree or pressing Ctrl+F opens a search box. While
+typing, the app jumps to the first tree whose name or one of its words starts
+with the text; Up and Down step through the matches.
+
+Started with ``BONSAI_PROFILE=1``, the app times its handlers and database
+calls and prints a summary on Ctrl+P and at exit, see ``bonsai_profiling``.
 
 Deleting the currently shown bonsai is achieved by clicking on 'Del. Bonsai'.
+
+Changed, added and deleted trees are collected and written to the database
+in one go when clicking on 'Save Changes'.
+
+The trees of further collections, e.g. of other sites, are shown next to the
+ones of ``db/bonsai_database.db`` when their databases are given on the
+command line. New trees are added to the collection of the shown tree:
+
+.. code-block:: bash
+
+    python bonsai_notifier.py --collection garden=db/garden.db
 """
 
-from bonsai_class import bonsai
-from datetime import datetime, date, timedelta
-from dateutil.relativedelta import relativedelta
+import time
+
+_import_start = time.perf_counter()
+
+# numpy is imported where it is needed, so it does not delay the first
+# window; PIL is not deferred, customtkinter imports it at import time
+from bonsai_class import bonsai, change_set, tree_collection
+import bonsai_database as bonsai_db
+from bonsai_dates import format_date, parse_date
+from bonsai_profiling import startup_profile, timed
+import bonsai_profiling
+from bonsai_info import info_store, info_document
+from bonsai_worker import io_worker
+from bonsai_assets import asset_cache
+import bonsai_schedule
+from datetime import date
 import tkinter as tk
+from tkinter import messagebox
+from functools import lru_cache
 import textwrap
 import customtkinter as ctk
-from PIL import Image, ImageTk
-import numpy as np
-import json
-import re
+import random
+import sys
 import os
 
+_import_time = time.perf_counter() - _import_start
+
+
+@lru_cache(maxsize=256)
+def wrap_name(name: str):
+    r"""
+    :return: the tree name wrapped for the name label.
+    """
+    return textwrap.fill(name, width=20)
+
 
 class bonsai_notifier:
     r"""
@@ -44,11 +89,13 @@ class bonsai_notifier:
     .. automethod:: update_last_pruning
     .. automethod:: update_last_repot
     .. automethod:: update_last_wiring
+    .. automethod:: update_all_fertilize
 
     remaining buttons:
 
     .. automethod:: next_bonsai
     .. automethod:: prev_bonsai
+    .. automethod:: search_bonsai
     .. automethod:: update_bonsai_database
     .. automethod:: show_info
     .. automethod:: add_bonsai
@@ -58,16 +105,36 @@ class bonsai_notifier:
     remaining:
     """
 
-    def __init__(self, master: object, db_file: str, dims: tuple):
+    def __init__(
+        self,
+        master: object,
+        db: object,
+        dims: tuple,
+        profile: object = None,
+        assets: object = None,
+        collections: dict = None,
+    ):
         # ----------------------------LOAD BONSAI CLASS------------------------
-        bonsai.initiate_database(db_file)
-        self.trees_at_start = bonsai.load_database(db_file)
-        self.trees = bonsai.load_database(db_file)
-
-        self.treeidx = np.random.randint(np.size(self.trees))
-
-        for tree in self.trees:
-            tree.set_info(db_file)
+        # db is the bonsai_database.database_connection owned by the app
+        self.db = db
+        # further collection databases attached next to db, name -> file
+        self.collections = collections or {}
+        self.master = master
+        self.profile = profile or startup_profile(enabled=False)
+        self.assets = assets or asset_cache(profile=self.profile)
+        # database work runs in the background, the connection is only used
+        # by the worker thread
+        self.worker = io_worker(master)
+        # filled once the database is loaded, see show_loaded
+        self.trees = tree_collection()
+        # trees waiting for the next save
+        self.changes = change_set()
+        self.saving = 0  # saves in flight
+        self.save_queued = False  # save again once the running one is done
+
+        # care notes, created once the worker has opened the connection,
+        # see show_loaded
+        self.infos = None
 
         self.actions = (
             "next_fertilize",
@@ -77,16 +144,76 @@ class bonsai_notifier:
         )
         self.fg_color = ("#4F101A", "#4F101A")
 
-        self.create_labels(master)
-        self.create_buttons(master, dims)
-        self.create_entries(master)
+        with self.profile.phase("widgets"):
+            self.create_labels(master)
+            self.create_buttons(master, dims)
+            self.create_entries(master)
+            self.create_search(master, dims)
+
+        self.set_pending(True)
+        self.worker.submit(
+            self.load_trees, done=self.show_loaded, error=self.load_failed
+        )
+
+    def load_trees(self):
+        r"""
+        Initializes and loads the database. Runs in the I/O worker.
 
-        self.Name_upon_creation = []
+        :return: List of bonsai objects.
+        """
+        with self.profile.phase("DB init"):
+            bonsai.initiate_database(self.db.conn)
+            bonsai_db.attach_collections(self.db.conn, self.collections)
+        with self.profile.phase("DB load"):
+            return bonsai.load_database(self.db.conn, collections=True)
+
+    def show_loaded(self, trees: list):
+        # loaded on demand and prefetched for the neighbours
+        self.infos = info_store(
+            self.db.conn, self.db.db_file, collections=self.collections
+        )
+        self.trees = tree_collection(trees)
+        self.trees.select(random.choice(trees))
+        self.show_tree()
+        self.set_pending(False)
+        # the search index is sorted by the worker, the loaded list is not
+        # changed by the app
+        trees_shown, generation = self.trees, self.trees.generation
+        self.worker.submit(
+            tree_collection.name_index,
+            trees,
+            done=lambda keys: trees_shown.set_index(keys, generation),
+        )
+        # report once the first frame with data has been drawn
+        self.master.after_idle(self.profile.report)
+
+    def load_failed(self, e: Exception):
+        r"""
+        Reports a database that cannot be opened, migrated or attached and
+        closes the app, nothing can be shown without the trees.
+        """
+        messagebox.showerror(
+            "Bonsai Notifier",
+            f"Loading the trees failed: {e}",
+            parent=self.master,
+        )
+        self.master.destroy()
+
+    def set_pending(self, pending: bool):
+        r"""
+        Disables the buttons while the trees are loaded.
+        """
+        state = "disabled" if pending else "normal"
+        for button in self.Buttons:
+            button.configure(state=state)
 
     def create_labels(self, master: object):
-        text = textwrap.fill(self.trees[self.treeidx].name, width=20)
         self.NameLabel = canvas.create_text(
-            170, 25, text=text, font=("Times", 20, "bold"), fill="white"
+            170,
+            25,
+            text="...",
+            font=("Times", 20, "bold"),
+            fill="white",
         )
         text = (
             textwrap.fill("next fertilize", width=10),
@@ -112,11 +239,23 @@ class bonsai_notifier:
         imagepath = os.path.join(
             os.path.dirname(os.path.abspath(__file__)), "images"
         )
+        # no CTk widget is registered yet, so the scaling of the canvas is
+        # not known to the tracker; CTkImage rescales the icons later on
+        scaling = (
+            ctk.ScalingTracker.get_window_dpi_scaling(master)
+            * ctk.ScalingTracker.widget_scaling
+        )
+        ButtonNextImage, ButtonPrevImage, ButtonChangeImage = [
+            ctk.CTkImage(
+                light_image=self.assets.load_decoded(
+                    f"{imagepath}/{name}.png", (20, 20), scaling
+                ),
+                size=(20, 20),
+            )
+            for name in ("arrow_right", "arrow_left", "plus")
+        ]
 
         # Next button
-        ButtonNextImage = ctk.CTkImage(
-            Image.open(f"{imagepath}/arrow_right.png")
-        )
         ButtonNext = ctk.CTkButton(
             canvas,
             image=ButtonNextImage,
@@ -130,9 +269,6 @@ class bonsai_notifier:
         ButtonNext.image = ButtonNextImage
         ButtonNext.place(x=dims[0] - 40, y=2)
         # previous button
-        ButtonPrevImage = ctk.CTkImage(
-            Image.open(f"{imagepath}/arrow_left.png")
-        )
         ButtonPrev = ctk.CTkButton(
             canvas,
             image=ButtonPrevImage,
@@ -146,7 +282,6 @@ class bonsai_notifier:
         ButtonPrev.place(x=0, y=2)
         # change button
         master.update()
-        ButtonChangeImage = ctk.CTkImage(Image.open(f"{imagepath}/plus.png"))
         ButtonChange = []
         cmd = (
             "self.update_next_fertilize",
@@ -168,6 +303,9 @@ class bonsai_notifier:
                 )
             )
             ButtonChange[ii].place(y=60 + ii * 75, x=dims[0] - 40)
+        ButtonChange[0].bind(
+            "<Button-3>", lambda event: self.update_all_fertilize(master)
+        )
         # add bonsai
         ButtonAddBonsai = ctk.CTkButton(
             canvas,
@@ -198,7 +336,7 @@ class bonsai_notifier:
             fg_color=self.fg_color,
             width=40,
             height=20,
-            command=lambda: self.update_bonsai_database(master, db_file),
+            command=lambda: self.update_bonsai_database(master),
         )
         ButtonSave.place(y=dims[1] - 30, x=dims[0] // 1.8)
         # show infos
@@ -213,6 +351,17 @@ class bonsai_notifier:
         )
         ButtonInfo.place(y=dims[1] - 30, x=dims[0] // 4.7)
 
+        self.ButtonSave = ButtonSave
+        self.Buttons = [
+            ButtonNext,
+            ButtonPrev,
+            *ButtonChange,
+            ButtonAddBonsai,
+            ButtonRemBonsai,
+            ButtonSave,
+            ButtonInfo,
+        ]
+
     def create_entries(self, master: object):
         self.DateInput = []
         for ii in range(4):
@@ -226,121 +375,299 @@ class bonsai_notifier:
                 )
             )
             self.DateInput[ii].place(x=130, y=65 + ii * 75)
-            self.DateInput[ii].insert(
-                0, getattr(self.trees[self.treeidx], self.actions[ii])
+        self.entry_color = self.DateInput[0].cget("text_color")
+        # typed texts that are no date, (key, action) -> text, and whether
+        # each entry is shown in red
+        self.invalid = {}
+        self.entry_invalid = [False] * 4
+
+    def create_search(self, master: object, dims: tuple):
+        r"""
+        Creates the search box. It opens over the name label when the name is
+        clicked or Ctrl+F is pressed.
+        """
+        self.SearchInput = ctk.CTkEntry(
+            canvas,
+            width=dims[0] - 100,
+            height=30,
+            border_width=0,
+            font=("Times", 20),
+            justify="center",
+        )
+        self.SearchInput.bind("<KeyRelease>", self.search_bonsai)
+        self.SearchInput.bind("<FocusOut>", lambda event: self.close_search())
+        canvas.tag_bind(
+            self.NameLabel, "<Button-1>", lambda event: self.open_search()
+        )
+        master.bind("<Control-f>", lambda event: self.open_search())
+        if bonsai_profiling.ENABLED:
+            # prints the hot path timings collected so far
+            master.bind(
+                "<Control-p>", lambda event: bonsai_profiling.report()
             )
+        self.search_text = ""
+        self.matches = []
 
     # -----------------------------------METHODS--------------------------------
+    @timed()
     def next_bonsai(self, DO_DELETE=False):
         self.update_inputfield(DO_DELETE)
-        trees = np.array(range(0, len(self.trees)))
-        self.treeidx = (self.treeidx + 1) % len(trees)
-
-        canvas.delete(self.NameLabel)
-        text = textwrap.fill(self.trees[self.treeidx].name, width=20)
-        self.NameLabel = canvas.create_text(
-            170, 25, text=text, font=("Times", 20, "bold"), fill="white"
-        )
-        self.change_inputfield()
+        self.trees.step(1)
+        self.show_tree()
 
+    @timed()
     def prev_bonsai(self):
         self.update_inputfield()
-        trees = np.array(range(0, len(self.trees)))
-        self.treeidx = (self.treeidx - 1) % len(trees)
+        self.trees.step(-1)
+        self.show_tree()
 
-        canvas.delete(self.NameLabel)
-        text = textwrap.fill(self.trees[self.treeidx].name, width=20)
-        self.NameLabel = canvas.create_text(
-            170, 25, text=text, font=("Times", 20, "bold"), fill="white"
+    def show_tree(self):
+        r"""
+        Shows the current tree. The name label is reconfigured in place and
+        only entries whose text differs are rewritten, so a click costs the
+        same for any collection size.
+        """
+        canvas.itemconfigure(
+            self.NameLabel, text=wrap_name(self.trees.current.name)
         )
         self.change_inputfield()
+        self.prefetch_info()
 
-    def update_next_fertilize(self):
-        next_fertilize = date.today() + relativedelta(months=2)
-
-        # if fertilizing happens to land in off-season, increase till growing
-        # season
-        if next_fertilize.month > 9:
-            next_fertilize = next_fertilize + relativedelta(
-                months=(3 - next_fertilize.month) % 12
-            )
-
-        # do not fertilizes for one month after repot
-        if self.DateInput[2].get() != "Not Yet":
-            last_repot = datetime.strptime(self.DateInput[2].get(), "%d.%m.%Y")
-            if next_fertilize < last_repot.date() + relativedelta(months=1):
-                next_fertilize = last_repot + relativedelta(months=1)
+    def prefetch_info(self):
+        r"""
+        Loads the notes of the shown tree and its neighbours in the
+        background, so the info window opens without a query.
+        """
+        tree = self.trees.current
+        trees = (
+            self.trees.neighbour(tree, -1),
+            tree,
+            self.trees.neighbour(tree, 1),
+        )
+        self.infos.prefetch({tree.key for tree in trees})
 
-        self.trees[self.treeidx].set_next_fertilize(
-            next_fertilize.strftime("%d.%m.%Y")
+    def update_next_fertilize(self):
+        # the repot date may have been edited without leaving the tree
+        try:
+            last_repot = parse_date(self.DateInput[2].get())
+        except ValueError:
+            last_repot = self.trees.current.last_repot
+        next_fertilize = bonsai_schedule.next_fertilize(
+            date.today(),
+            last_repot,
+            bonsai_schedule.species_of(self.trees.current.name),
         )
+
+        if self.trees.current.set_next_fertilize(next_fertilize):
+            self.changes.add(self.trees.current)
         self.DateInput[0].delete(0, "end")
-        self.DateInput[0].insert(0, self.trees[self.treeidx].next_fertilize)
+        self.DateInput[0].insert(
+            0, format_date(self.trees.current.next_fertilize)
+        )
+
+    def update_all_fertilize(self, master: object):
+        r"""
+        Plans the next fertilization of every tree with the schedule rules and
+        writes the changed trees with one save.
+        """
+        self.update_inputfield()
+        for tree in bonsai_schedule.recompute_fertilize(self.trees):
+            self.changes.add(tree)
+        self.change_inputfield()
+        self.update_bonsai_database(master)
 
     def update_last_pruning(self):
-        self.trees[self.treeidx].set_last_pruning(
-            date.today().strftime("%d.%m.%Y")
-        )
+        if self.trees.current.set_last_pruning(date.today()):
+            self.changes.add(self.trees.current)
         self.DateInput[1].delete(0, "end")
-        self.DateInput[1].insert(0, self.trees[self.treeidx].last_pruning)
+        self.DateInput[1].insert(
+            0, format_date(self.trees.current.last_pruning)
+        )
 
     def update_last_repot(self):
-        self.trees[self.treeidx].set_last_repot(
-            date.today().strftime("%d.%m.%Y")
-        )
+        if self.trees.current.set_last_repot(date.today()):
+            self.changes.add(self.trees.current)
         self.DateInput[2].delete(0, "end")
-        self.DateInput[2].insert(0, self.trees[self.treeidx].last_repot)
+        self.DateInput[2].insert(
+            0, format_date(self.trees.current.last_repot)
+        )
 
     def update_last_wiring(self):
-        self.trees[self.treeidx].set_last_wiring(
-            date.today().strftime("%d.%m.%Y")
-        )
+        if self.trees.current.set_last_wiring(date.today()):
+            self.changes.add(self.trees.current)
         self.DateInput[3].delete(0, "end")
-        self.DateInput[3].insert(0, self.trees[self.treeidx].last_wiring)
+        self.DateInput[3].insert(
+            0, format_date(self.trees.current.last_wiring)
+        )
 
     def update_inputfield(self, DO_DELETE=False):
         r"""
-        Here, the current entries are updated.
+        Here, the current entries are updated. Fields whose value changed are
+        marked dirty and the tree is queued for the next save. Entries that are
+        no valid date keep the stored value; the typed text is kept and shown
+        in red until it is corrected, and it is not saved.
         """
 
-        if not DO_DELETE:
-            DateInput_new = [self.DateInput[ii].get() for ii in range(0, 4)]
-
-            # DateInput_old = [getattr(self.trees[self.treeidx], self.actions[ii]) for ii in range(0,4)]
-            [
-                setattr(
-                    self.trees[self.treeidx],
-                    self.actions[ii],
-                    DateInput_new[ii],
-                )
-                for ii in range(0, 4)
-            ]  # if DateInput_new != DateInput_old
+        if DO_DELETE:
+            return
+        tree = self.trees.current
+        key = tree.key
+        for ii, action in enumerate(self.actions):
+            text = self.DateInput[ii].get()
+            try:
+                value = parse_date(text)
+            except ValueError:
+                self.invalid[(key, action)] = text
+                self.mark_invalid(ii, True)
+                continue
+            if self.invalid:
+                self.invalid.pop((key, action), None)
+            self.mark_invalid(ii, False)
+            if tree.set_action(action, value):
+                self.changes.add(tree)
+
+    def mark_invalid(self, ii: int, invalid: bool):
+        r"""
+        Shows the text of the entry ``ii`` in red if it is no valid date.
+        """
+        if self.entry_invalid[ii] != invalid:
+            self.entry_invalid[ii] = invalid
+            self.DateInput[ii].configure(
+                text_color="red" if invalid else self.entry_color
+            )
 
     def change_inputfield(self):
         r"""
         Changes the entry fields upon button press
         """
-        [self.DateInput[ii - 1].delete(0, "end") for ii in range(1, 5)]
-        [
-            self.DateInput[ii].insert(
-                0, getattr(self.trees[self.treeidx], self.actions[ii])
-            )
-            for ii in range(0, 4)
-        ]
-
-    def update_bonsai_database(self, master: object, db_file: str):
+        tree = self.trees.current
+        key = tree.key
+        for ii, action in enumerate(self.actions):
+            text = self.invalid.get((key, action)) if self.invalid else None
+            self.mark_invalid(ii, text is not None)
+            if text is None:
+                text = format_date(getattr(tree, action))
+            entry = self.DateInput[ii]
+            if entry.get() != text:
+                entry.delete(0, "end")
+                entry.insert(0, text)
+
+    @timed()
+    def update_bonsai_database(self, master: object):
         r"""
-        When Save Change is pressed, the entire list of bonsai classes is
-        compared with that at the start of the app.
-        If they differ, the bonsai database is updated.
+        When Save Change is pressed, all trees collected in the change set
+        since the last save are written to the bonsai database in a single
+        transaction. The notes of deleted trees are removed with them.
+        Trees whose changed fields were all set back to the stored values
+        are skipped. The trees are written from snapshots by the I/O worker;
+        the button shows the save until it is done and trees can be edited
+        meanwhile.
+        A save requested meanwhile starts when the running one is done, so
+        every save knows the versions written by the one before.
         """
 
         self.update_inputfield()
-        if self.trees_at_start != self.trees:
-            for idx, tree in enumerate(self.trees):
-                if tree != self.trees_at_start[idx]:
-                    bonsai.update_database(tree, db_file, True)
-            self.trees_at_start = self.trees
+        invalid = {self.trees.get(t, c) for (c, t), _ in self.invalid}
+        invalid.discard(None)
+        if invalid:
+            messagebox.showwarning(
+                "Save Changes",
+                "Not saved, no date of the form dd.mm.YYYY: "
+                + ", ".join(sorted(tree.name for tree in invalid)),
+                parent=self.master,
+            )
+        if not self.saving:
+            # trees set back to their stored values need no new version
+            self.changes.drop_clean()
+        if not self.changes:
+            return
+        if self.saving:
+            self.save_queued = True
+            return
+        taken = self.changes.take()
+        records = [tree.snapshot() for tree in taken.dirty.values()]
+        removed = [tree.snapshot() for tree in taken.removed.values()]
+        self.saving += 1
+        self.ButtonSave.configure(text="Saving...", state="disabled")
+        self.worker.submit(
+            bonsai.save_records,
+            self.db.conn,
+            records,
+            removed,
+            dict(taken.notes),
+            done=lambda result: self.saved(taken, records, result),
+            error=lambda e: self.save_failed(taken, e),
+        )
+
+    def saved(self, taken: change_set, records: list, result: tuple):
+        rows, elapsed = result
+        for tree, record in zip(taken.dirty.values(), records):
+            tree.version = (tree.version or 0) + 1
+            tree.saved_as(record)
+        for key in taken.removed:
+            self.infos.discard(key)
+        if bonsai_profiling.ENABLED:
+            bonsai_profiling.record("bonsai_notifier.saved", elapsed)
+        self.save_finished()
+        if not self.saving:
+            # the button shows the result for a moment
+            text = f"Saved {rows} trees"
+            self.ButtonSave.configure(text=text)
+            self.master.after(2000, lambda: self.reset_save_button(text))
+
+    def save_failed(self, taken: change_set, e: Exception):
+        if isinstance(e, bonsai_db.version_conflict):
+            # another instance saved these trees meanwhile; the next save
+            # overwrites its changes knowingly. New trees whose id it took
+            # get a fresh one instead and are saved again right away, their
+            # notes are not stored yet and move along with them.
+            names = []
+            for key, version in e.conflicts.items():
+                tree = taken.dirty.get(key) or taken.removed.get(key)
+                if key in taken.dirty and tree.version is None:
+                    del taken.dirty[key]
+                    self.changes.dirty.pop(key, None)
+                    if tree in self.trees:
+                        self.trees.renumber(
+                            tree, self.trees.new_id(tree.collection)
+                        )
+                        taken.dirty[tree.key] = tree
+                        for notes in (taken.notes, self.changes.notes):
+                            if key in notes:
+                                notes[tree.key] = notes.pop(key)
+                        self.infos.move(key, tree.key)
+                    else:
+                        taken.notes.pop(key, None)
+                    continue
+                tree.version = version
+                names.append(tree.name)
+            self.save_queued = not names
+            if names:
+                messagebox.showwarning(
+                    "Save Changes",
+                    "Changed by another instance meanwhile: "
+                    f"{', '.join(names)}. Save again to overwrite.",
+                    parent=self.master,
+                )
+        else:
+            messagebox.showerror(
+                "Save Changes", f"Saving failed: {e}", parent=self.master
+            )
+        # keep the changes for the next try
+        self.changes.merge(taken)
+        self.save_finished()
+
+    def save_finished(self):
+        self.saving -= 1
+        if not self.saving:
+            self.ButtonSave.configure(text="Save Changes", state="normal")
+            if self.save_queued:
+                self.save_queued = False
+                self.update_bonsai_database(self.master)
+
+    def reset_save_button(self, text: str):
+        if not self.saving and self.ButtonSave.cget("text") == text:
+            self.ButtonSave.configure(text="Save Changes")
 
     # -----------------------------Create new window---------------------------
     def create_new_window(self, master: object):
@@ -349,12 +676,57 @@ class bonsai_notifier:
         window.wm_attributes("-type", "splash")
         return window
 
+    # -----------------------------------SEARCH---------------------------------
+    def open_search(self):
+        self.trees.index_names()
+        self.search_text = ""
+        self.matches = []
+        self.SearchInput.delete(0, "end")
+        self.SearchInput.place(x=50, y=10)
+        self.SearchInput.focus_set()
+
+    def close_search(self):
+        self.SearchInput.place_forget()
+        canvas.focus_set()
+
+    def search_bonsai(self, event: object):
+        r"""
+        Jumps to the first tree whose name or one of its words starts with the
+        typed text. Up and Down step through the matches, Return and Escape
+        close the search box.
+        """
+        if event.keysym in ("Return", "KP_Enter", "Escape"):
+            self.close_search()
+            return
+        if event.keysym in ("Up", "Down") and self.matches:
+            step = 1 if event.keysym == "Down" else -1
+            current = self.trees.current
+            ii = self.matches.index(current) if current in self.matches else 0
+            self.jump_to(self.matches[(ii + step) % len(self.matches)])
+            return
+
+        text = self.SearchInput.get()
+        if text == self.search_text:
+            return
+        self.search_text = text
+        self.matches = self.trees.search(text)
+        if self.matches:
+            self.jump_to(self.matches[0])
+
+    def jump_to(self, tree: bonsai):
+        if tree is self.trees.current:
+            return
+        self.update_inputfield()
+        self.trees.select(tree)
+        self.show_tree()
+
     # --------------------------show and save info window----------------------
-    def show_info(self, master: object, init=False):
+    @timed()
+    def show_info(self, master: object, tree: bonsai = None):
         """
-        Raises another toplevel window showing some additional infos in a list
-        of bullet points. If the tree is initialized, some placeholding points
-        are shown.
+        Raises another toplevel window showing some additional infos of
+        ``tree``, by default the shown one, in a list of bullet points. For a
+        tree without notes, some placeholding points are shown.
         The structure is: \n
         Method: \n
         \*points. \n
@@ -371,10 +743,10 @@ class bonsai_notifier:
 
         window.geometry("%dx%d+%d+%d" % (dims[0], dims[1], x, y))
 
-        if init:
-            text = self.Name_upon_creation[0]
-        else:
-            text = self.trees[self.treeidx].name
+        # names may repeat, so the tree is passed on as is
+        if tree is None:
+            tree = self.trees.current
+        text = tree.name
 
         BonsaiLabel = ctk.CTkLabel(
             window,
@@ -391,44 +763,18 @@ class bonsai_notifier:
             row=0, column=1, pady=(10, 0), padx=dims[0] // 2 - w // 2
         )
 
-        index = next(
-            (
-                ii
-                for ii, obj in enumerate(self.trees)
-                if obj.name == BonsaiLabel.cget("text")
-            ),
-            None,
-        )
-
-        if os.path.exists(self.trees[index].info):
-            with open(self.trees[index].info, "r") as json_file:
-                info = json.load(json_file)
-
         text_widget = ctk.CTkTextbox(
             window,
-            activate_scrollbars=True,
+            activate_scrollbars=False,
             font=("Times", 20),
-            width=dims[0],
+            width=dims[0] - 16,
             height=dims[1],
             fg_color="#25212F",
         )
         text_widget.grid(row=2, column=1)
-
-        if os.path.exists(self.trees[index].info):
-            # Insert JSON data into the text widget
-            for action, points in info.items():
-                text_widget.insert(tk.END, f"{action}:\n")
-                for point in points:
-                    text_widget.insert(tk.END, f"    • {point}\n")
-                    text_widget.insert(tk.END, "\n")
-
-        else:
-            actions = ["Repot", "Pruning", "Wiring"]
-            for action in actions:
-                text_widget.insert(tk.END, f"{action}:\n")
-                for point in range(3):
-                    text_widget.insert(tk.END, "    • \n")
-                    text_widget.insert(tk.END, "\n")
+        scrollbar = ctk.CTkScrollbar(window, command=text_widget.yview)
+        scrollbar.grid(row=2, column=2, sticky="ns")
+        text_widget.configure(yscrollcommand=scrollbar.set)
 
         # close window
         ButtonClose = ctk.CTkButton(
@@ -442,7 +788,7 @@ class bonsai_notifier:
         )
         ButtonClose.place(y=11, x=dims[0] // 2 + w // 2 + 20)
 
-        # save changes
+        # save changes, enabled once the notes are shown
         ButtonSave = ctk.CTkButton(
             window,
             text="Save",
@@ -450,56 +796,77 @@ class bonsai_notifier:
             fg_color=self.fg_color,
             width=40,
             height=20,
-            command=lambda: self.save_info(master, text_widget, BonsaiLabel),
+            state="disabled",
         )
         ButtonSave.place(y=11, x=dims[0] // 2 - w // 2 - 70)
 
+        def loaded(notes):
+            if not window.winfo_exists():
+                return
+            document = info_document(notes)
+
+            # long notes are inserted chunk by chunk as they are scrolled
+            # into view
+            def scrolled(first, last):
+                scrollbar.set(first, last)
+                if float(last) > 0.9 and document.remaining():
+                    text_widget.insert(tk.END, document.next_chunk())
+
+            text_widget.configure(yscrollcommand=scrolled)
+            text_widget.insert(tk.END, document.next_chunk())
+            ButtonSave.configure(
+                state="normal",
+                command=lambda: self.save_info(
+                    master, text_widget, tree, document, ButtonSave
+                ),
+            )
+
+        self.worker.submit(self.infos.get, tree.key, done=loaded)
+
+    @timed()
     def save_info(
-        self, master: object, text_widget: object, BonsaiLabel: object
+        self,
+        master: object,
+        text_widget: object,
+        tree: bonsai,
+        document: info_document,
+        ButtonSave: object,
     ):
         """
         Converts the info text string into a dictionary of the same shape as the input
-        and saves it to a json file with the same name as the bonsai name
+        and saves it to the database. Only the sections edited since the
+        window was opened are parsed again. The notes are written by the I/O
+        worker, the button is disabled meanwhile. The notes of a tree not
+        saved yet are kept in the change set and written together with the
+        tree, so they never stay behind under an id that is given away again.
         """
-        info = text_widget.get("1.0", "end-1c")
-        sections = re.split(r"\n+", info.strip())
-        info_out = {}
-        action = ""
-        content = []
-
-        for section in sections:
-            if action != "" and action != section.strip(":"):
-                info_out[action] = content
-
-            if ":" in section:
-                action = section.strip(":")
-                content = []
-            else:
-                content.append(section.strip().strip("• "))
-
-        index = next(
-            (
-                ii
-                for ii, obj in enumerate(self.trees)
-                if obj.name == BonsaiLabel.cget("text")
-            ),
-            None,
+        info_out = document.parse(text_widget.get("1.0", "end-1c"))
+        if tree.version is None:
+            self.changes.notes[tree.key] = info_out
+            self.infos.put(tree.key, info_out)
+            return
+
+        def saved(result):
+            if ButtonSave.winfo_exists():
+                ButtonSave.configure(text="Save", state="normal")
+
+        def failed(e):
+            print(f"saving the notes failed: {e}", file=sys.stderr)
+            saved(None)
+
+        ButtonSave.configure(text="Saving...", state="disabled")
+        self.worker.submit(
+            self.infos.save, tree.key, info_out, done=saved, error=failed
         )
 
-        info_out = {
-            key: [s.replace("*", "") for s in value]
-            for key, value in info_out.items()
-        }
-
-        with open(self.trees[index].info, "w") as json_file:
-            json.dump(info_out, json_file, indent=4)
-
     # --------------------------Add new and remove old bonsai methods---------------
+    @timed()
     def add_bonsai(self, master: object, dims: tuple):
         """
         Creates a new toplevel window asking for the name and the purchase date
-        of the new tree and adds the tree to the database. Filling additional
-        infos is possible after submitting to the database.
+        of the new tree and adds the tree to the collection. It is written to
+        the database with the next save. Filling additional infos is possible
+        after submitting.
         """
 
         window = self.create_new_window(master)
@@ -546,7 +913,6 @@ class bonsai_notifier:
             fg_color=self.fg_color,
             width=40,
             height=20,
-            command=lambda: self.show_info(master, init=True),
             state=tk.DISABLED,
         )
         ButtonInitInfo.place(y=dims[1] - 30, x=dims[0] // 2.5)
@@ -559,7 +925,7 @@ class bonsai_notifier:
             width=40,
             height=20,
             command=lambda: add_new_bonsai(
-                self, master, db_file, text, ButtonInitInfo
+                self, master, self.db.db_file, text, ButtonInitInfo
             ),
         )
         ButtonSubmit.place(y=dims[1] - 30, x=dims[0] // 5)
@@ -584,52 +950,32 @@ class bonsai_notifier:
         ):
             # calculate the need fertilizing date
             Input = [Queries[ii].get() for ii in range(2)]
-            if 3 <= datetime.now().month <= 9:
-                Input[1] = datetime.strptime(Input[1], "%d.%m.%Y") + timedelta(
-                    days=7
-                )
-            else:
-                Input[1] = datetime.strptime(
-                    Input[1], "%d.%m.%Y"
-                ) + relativedelta(months=1)
-            Input[1] = Input[1].strftime("%d.%m.%Y")
-
-            # create a new tree id
-            newid = int(
-                1
-                + np.max(
-                    [
-                        self.trees[ii].treeid
-                        for ii in range(0, np.size(self.trees))
-                    ]
-                )
+            Input[1] = bonsai_schedule.first_fertilize(
+                parse_date(Input[1]),
+                species=bonsai_schedule.species_of(Input[0]),
             )
 
-            # create known attributes for the new tree
-            Input.insert(0, newid)
-            bonsai_attributes = ["treeid", "name", self.actions[0]]
-
-            # append the list of bonsai classes by one and set the new attributes
-            self.trees.append(bonsai())
-            [
-                setattr(self.trees[-1], bonsai_attributes[ii], Input[ii])
-                for ii in range(3)
-            ]
-
-            directory, filename = os.path.split(db_file)
-
-            setattr(
-                self.trees[-1],
-                "info",
-                f"{directory}/{self.trees[-1].name}.json",
+            # append the collection of the shown tree by the new tree with a
+            # fresh id
+            collection = bonsai_db.MAIN
+            if self.trees.current is not None:
+                collection = self.trees.current.collection
+            tree = bonsai(
+                treeid=self.trees.new_id(collection),
+                name=Input[0],
+                next_fertilize=Input[1],
+                collection=collection,
             )
-            bonsai.update_database(self.trees[-1], db_file, True)
+            self.trees.append(tree)
 
-            self.Name_upon_creation.append(Queries[0].get())
+            self.changes.add(tree)
 
-            # if bonsai was submitted to the database, enable filling infos
+            # if bonsai was submitted, enable filling infos of this tree
             if ButtonInitInfo != None:
-                ButtonInitInfo.configure(state="normal")
+                ButtonInitInfo.configure(
+                    state="normal",
+                    command=lambda: self.show_info(master, tree),
+                )
             # cleaning up
             # [Queries[ii].delete(0,'end') for ii in range(0,2)]
             # [Queries[ii].insert(0,text[ii]) for ii in range(0,2)]
@@ -637,13 +983,12 @@ class bonsai_notifier:
     def remove_bonsai(self):
         # here are 2 bugs:
         # 2. if a bonsai is deleted, the previous one has its entries
-        bonsai.update_database(self.trees[self.treeidx], db_file, False)
-        if os.path.isfile(self.trees[self.treeidx].info):
-            os.remove(self.trees[self.treeidx].info)
-        self.trees.remove(self.trees[self.treeidx])
-        self.treeidx = self.treeidx - 1
-        if self.treeidx < 0:
-            self.treeidx = 0
+        # the cursor moves to the previous tree, next_bonsai shows the
+        # one that followed the deleted tree
+        for action in self.actions:
+            self.invalid.pop((self.trees.current.key, action), None)
+        self.changes.remove(self.trees.current)
+        self.trees.remove(self.trees.current)
         self.next_bonsai(DO_DELETE=True)
 
 
@@ -651,6 +996,19 @@ class bonsai_notifier:
 
 
 if __name__ == "__main__":
+    # --profile-startup prints how long each phase of the start took
+    profile = startup_profile(
+        enabled="--profile-startup" in sys.argv, start=_import_start
+    )
+    profile.add("imports", _import_time)
+
+    # --collection NAME=FILE shows the trees of a further collection database
+    collections = dict(
+        value.partition("=")[::2]
+        for flag, value in zip(sys.argv, sys.argv[1:])
+        if flag == "--collection"
+    )
+
     base_dir = os.path.dirname(os.path.abspath(__file__))
     db_file = os.path.join(base_dir, "db/bonsai_database.db")
     root = tk.Tk()
@@ -681,12 +1039,19 @@ if __name__ == "__main__":
     )
     canvas.pack(fill="both", expand=True)
 
+    assets = asset_cache(profile=profile)
     img_file = os.path.join(base_dir, "images/bg_drawing.png")
-    background_img = ImageTk.PhotoImage(
-        Image.open(img_file).resize((w, h))
-    )  # Image.ANTIALIAS
+    background_img = assets.load(root, img_file, (w, h))
     canvas.create_image(-20, 0, image=background_img, anchor="nw")
 
-    b = bonsai_notifier(root, db_file, (w, h))
-
-    root.mainloop()
+    # one connection for the whole session, closed when the window is gone
+    with bonsai_db.database_connection(
+        db_file, check_same_thread=False
+    ) as db:
+        b = bonsai_notifier(root, db, (w, h), profile, assets, collections)
+
+        root.mainloop()
+        # pending saves are finished before the connection is closed
+        b.worker.close()
+        if b.infos is not None:
+            b.infos.close()
@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Author: Viktor Pfaffenrot
+
+
+Lightweight timing helpers. :class:`startup_profile` collects the wall time
+of the phases of the app start, e.g. imports, database initialization,
+loading, widget creation and image decoding, and prints a breakdown when the
+app is started with ``--profile-startup``.
+
+Setting the environment variable ``BONSAI_PROFILE=1`` times the hot paths
+while the app runs: the UI handlers decorated with :func:`timed`, every public
+function of ``bonsai_database`` and every SQL statement, keyed by its text.
+Calls are counted and their latencies kept in :class:`histogram` objects; a
+summary is printed at exit and, in the app, on Ctrl+P. Without the variable
+the decorators return the functions unchanged and connections are plain
+``sqlite3`` connections, so nothing is measured and nothing costs time.
+"""
+
+from contextlib import contextmanager, nullcontext
+import functools
+import threading
+import sqlite3
+import atexit
+import math
+import time
+import sys
+import os
+
+#: environment variable switching the hot path timing on
+ENV_VAR = "BONSAI_PROFILE"
+#: True if the hot path timing is on, read once at import
+ENABLED = os.environ.get(ENV_VAR, "") not in ("", "0")
+
+
+class startup_profile:
+    r"""
+    Accumulates the time spent per named phase. Phases may be entered several
+    times, their times add up. A disabled profile does not measure anything.
+
+    .. code-block:: python
+
+        profile = startup_profile(enabled=True)
+        with profile.phase("DB init"):
+            bonsai.initiate_database(conn)
+        profile.report()
+    """
+
+    def __init__(self, enabled: bool = True, start: float = None):
+        self.enabled = enabled
+        self.start = time.perf_counter() if start is None else start
+        self.phases = {}
+
+    def add(self, name: str, seconds: float):
+        if self.enabled:
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    @contextmanager
+    def phase(self, name: str):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def report(self, file=sys.stderr):
+        r"""
+        Prints one line per phase and the total time since ``start``.
+        """
+        if not self.enabled:
+            return
+        total = time.perf_counter() - self.start
+        print("startup profile:", file=file)
+        for name, seconds in self.phases.items():
+            print(f"  {name:<16}{seconds * 1000:9.1f} ms", file=file)
+        print(f"  {'total':<16}{total * 1000:9.1f} ms", file=file)
+
+
+# ---------------------------------HOT PATHS------------------------------------
+class histogram:
+    r"""
+    Latency histogram with four buckets per power of two microseconds, so
+    percentiles are accurate to about 19 %. Adding a value costs one
+    logarithm; memory does not grow with the number of calls.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0  #: seconds
+        self.max = 0.0  #: seconds
+        self.buckets = {}
+
+    def add(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        bucket = int(4 * math.log2(max(seconds * 1e6, 1.0)))
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+
+    def percentile(self, q: float):
+        r"""
+        :return: upper bound in seconds of the bucket holding the ``q``
+            quantile, at most the largest value seen.
+        """
+        rank = q * self.count
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return min(2 ** ((bucket + 1) / 4) / 1e6, self.max)
+        return self.max
+
+
+#: histograms of the timed names
+stats = {}
+_lock = threading.Lock()  # the I/O worker records as well
+
+
+def record(name: str, seconds: float):
+    r"""
+    Adds a latency to the histogram of ``name``.
+    """
+    with _lock:
+        hist = stats.get(name)
+        if hist is None:
+            hist = stats[name] = histogram()
+        hist.add(seconds)
+
+
+def timed(name: str = None):
+    r"""
+    Decorator recording the latency of every call under ``name``, by default
+    the qualified name of the function. Generators are timed until they are
+    exhausted. Returns the function unchanged unless :data:`ENABLED`.
+    """
+
+    def decorate(func):
+        if not ENABLED:
+            return func
+        label = name or func.__qualname__
+
+        if func.__code__.co_flags & 0x20:  # CO_GENERATOR
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    yield from func(*args, **kwargs)
+                finally:
+                    record(label, time.perf_counter() - start)
+
+            return wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record(label, time.perf_counter() - start)
+
+        return wrapper
+
+    return decorate
+
+
+def timed_block(name: str):
+    r"""
+    :return: context manager recording the time spent in the block under
+        ``name``, a no-op unless :data:`ENABLED`.
+    """
+    if not ENABLED:
+        return nullcontext()
+    return _timed_block(name)
+
+
+@contextmanager
+def _timed_block(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start)
+
+
+def instrument(namespace: dict, prefix: str):
+    r"""
+    Wraps every public function defined in the module of ``namespace`` with
+    :func:`timed` under ``prefix.name``. Call it at the end of a module with
+    ``globals()``; does nothing unless :data:`ENABLED`.
+    """
+    if not ENABLED:
+        return
+    module = namespace["__name__"]
+    for key, value in list(namespace.items()):
+        if (
+            callable(value)
+            and hasattr(value, "__code__")
+            and value.__module__ == module
+            and not key.startswith("_")
+        ):
+            namespace[key] = timed(f"{prefix}.{key}")(value)
+
+
+def _statement(sql: str):
+    return "sql: " + " ".join(sql.split())
+
+
+class timed_cursor(sqlite3.Cursor):
+    r"""
+    Cursor recording the time of every statement under its text. Only
+    executing is timed, fetching the rows of a query afterwards is not.
+    """
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            record(_statement(sql), time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            record(_statement(sql), time.perf_counter() - start)
+
+
+class timed_connection(sqlite3.Connection):
+    r"""
+    Connection handing out :class:`timed_cursor` objects, pass it as
+    ``factory`` to ``sqlite3.connect``.
+    """
+
+    def cursor(self, factory=timed_cursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+#: connection class to use, timed only if :data:`ENABLED`
+connection_factory = timed_connection if ENABLED else sqlite3.Connection
+
+
+def report(file=sys.stderr, limit: int = 40):
+    r"""
+    Prints the ``limit`` names with the largest total time: calls, total,
+    mean, median, 99th percentile and maximum.
+    """
+    with _lock:
+        rows = sorted(stats.items(), key=lambda item: -item[1].total)
+        rows = [
+            (
+                name,
+                hist.count,
+                hist.total * 1000,
+                hist.total / hist.count * 1000,
+                hist.percentile(0.5) * 1000,
+                hist.percentile(0.99) * 1000,
+                hist.max * 1000,
+            )
+            for name, hist in rows[:limit]
+        ]
+    if not rows:
+        return
+    print(
+        f"{'calls':>8} {'total ms':>10} {'mean':>8} {'p50':>8} {'p99':>8}"
+        f" {'max':>8}  name",
+        file=file,
+    )
+    for name, *values in rows:
+        count, total, mean, p50, p99, maximum = values
+        print(
+            f"{count:>8} {total:>10.1f} {mean:>8.3f} {p50:>8.3f}"
+            f" {p99:>8.3f} {maximum:>8.3f}  {name[:100]}",
+            file=file,
+        )
+
+
+if ENABLED:
+    atexit.register(report)
@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Author: Viktor Pfaffenrot
+
+
+Fertilization schedule of the bonsai. The rules are declared per species in
+:data:`RULES`; the default rules are:
+
+* fertilize again two months from today,
+* dates landing outside of March to September are moved to the start of the
+  next season, keeping the day of the month,
+* do not fertilize for one month after repotting,
+* fertilize a new tree a week after the purchase in season, a month after
+  it otherwise.
+
+The species of a tree is told by a word of its name, see :data:`SPECIES`.
+The seasonal rules are compiled into one table per species and year holding
+the next fertilization date for every day, so a due date is a table lookup
+plus the repot block. :func:`next_fertilize` applies them to a single tree,
+:func:`recompute_fertilize` to the whole collection at once using NumPy
+``datetime64`` arrays. After :func:`set_rule` only the trees of the changed
+species need to be recomputed.
+"""
+
+from collections import namedtuple
+from functools import lru_cache
+from datetime import date, timedelta
+from array import array
+import calendar
+
+FERTILIZE_MONTHS = 2  #: months between two fertilizations
+LAST_MONTH = 9  #: last month of the growing season
+FIRST_MONTH = 3  #: first month of the growing season
+REPOT_BLOCK_MONTHS = 1  #: months without fertilizer after repotting
+
+_EPOCH = date(1970, 1, 1).toordinal()  # ordinal of datetime64 day 0
+
+#: care rules of a species: months between two fertilizations, the season as
+#: ``(first month, last month)`` windows, months without fertilizer after
+#: repotting, and days in season or months off season until a new tree is
+#: fertilized first
+care_rule = namedtuple(
+    "care_rule",
+    (
+        "fertilize_months",
+        "season",
+        "repot_block_months",
+        "new_tree_days",
+        "new_tree_months",
+    ),
+)
+
+#: species of the trees not matching any of :data:`SPECIES`
+DEFAULT = "default"
+
+#: care rules per species
+RULES = {
+    DEFAULT: care_rule(
+        FERTILIZE_MONTHS,
+        ((FIRST_MONTH, LAST_MONTH),),
+        REPOT_BLOCK_MONTHS,
+        7,
+        1,
+    ),
+    # tropical and kept indoors, grows into autumn
+    "ficus": care_rule(1, ((3, 10),), 1, 7, 1),
+    "trident maple": care_rule(2, ((3, 9),), 1, 14, 1),
+    # no fertilizer while flowering, roots are sensitive after repotting
+    "satsuki azalea": care_rule(2, ((3, 4), (7, 9)), 2, 14, 1),
+    # spring feeding and a second one for the autumn growth
+    "five needle pine": care_rule(2, ((3, 5), (9, 10)), 2, 14, 1),
+}
+
+#: words in the lower case tree name telling its species, the first one wins
+SPECIES = (
+    ("ficus", "ficus"),
+    ("trident", "trident maple"),
+    ("satsuki", "satsuki azalea"),
+    ("satzuki", "satsuki azalea"),
+    ("azalea", "satsuki azalea"),
+    ("5 needle", "five needle pine"),
+    ("five needle", "five needle pine"),
+)
+
+_tables = {}  # (species, year) -> compiled season table
+
+
+def add_months(day: date, months: int):
+    r"""
+    Adds months to a date; the day is clipped to the length of the target
+    month like ``dateutil.relativedelta`` does.
+    """
+    month = day.month - 1 + months
+    year = day.year + month // 12
+    month = month % 12 + 1
+    return date(year, month, min(day.day, calendar.monthrange(year, month)[1]))
+
+
+# ----------------------------------SPECIES-------------------------------------
+@lru_cache(maxsize=4096)
+def species_of(name: str):
+    r"""
+    :return: the species of a tree named ``name``, :data:`DEFAULT` if no word
+        of :data:`SPECIES` is part of it.
+    """
+    name = name.lower()
+    for word, species in SPECIES:
+        if word in name:
+            return species
+    return DEFAULT
+
+
+def in_season(day: date, species: str = DEFAULT):
+    r"""
+    :return: True if ``day`` lies in a season window of ``species``.
+    """
+    return any(
+        first <= day.month <= last for first, last in RULES[species].season
+    )
+
+
+def _season_start(day: date, rule: care_rule):
+    r"""
+    :return: ``day`` if it is in season, else the same day of the first
+        month of the next season window.
+    """
+    months = {
+        month
+        for first, last in rule.season
+        for month in range(first, last + 1)
+    }
+    for ahead in range(12):
+        if (day.month - 1 + ahead) % 12 + 1 in months:
+            return add_months(day, ahead)
+    return day
+
+
+def _compile(rule: care_rule, year: int):
+    r"""
+    :return: array of the day ordinals of the next fertilization, without the
+        repot block, for a tree fertilized on each day of ``year``.
+    """
+    start = date(year, 1, 1)
+    return array(
+        "l",
+        (
+            _season_start(
+                add_months(start + timedelta(days=ii), rule.fertilize_months),
+                rule,
+            ).toordinal()
+            for ii in range(366 if calendar.isleap(year) else 365)
+        ),
+    )
+
+
+def season_table(species: str, year: int):
+    r"""
+    :return: compiled table of ``species`` for ``year``, see
+        :func:`_compile`. Tables are built on first use.
+    """
+    table = _tables.get((species, year))
+    if table is None:
+        table = _tables[(species, year)] = _compile(RULES[species], year)
+    return table
+
+
+def set_rule(species: str, rule: care_rule):
+    r"""
+    Replaces the rules of ``species`` and drops its compiled tables. Recompute
+    the trees of that species only with
+    ``recompute_fertilize(trees, species={species})``.
+
+    :return: True if the rules changed.
+    """
+    if RULES.get(species) == rule:
+        return False
+    RULES[species] = rule
+    for key in [key for key in _tables if key[0] == species]:
+        del _tables[key]
+    return True
+
+
+# ---------------------------------SCHEDULE-------------------------------------
+def next_fertilize(
+    today: date, last_repot: date = None, species: str = DEFAULT
+):
+    r"""
+    :return: next fertilization date of a tree of ``species`` last repotted on
+        ``last_repot``.
+    """
+    table = season_table(species, today.year)
+    next_date = date.fromordinal(
+        table[today.toordinal() - date(today.year, 1, 1).toordinal()]
+    )
+
+    # do not fertilizes for some time after repot
+    if last_repot is not None:
+        blocked = add_months(last_repot, RULES[species].repot_block_months)
+        if next_date < blocked:
+            next_date = blocked
+
+    return next_date
+
+
+def first_fertilize(
+    purchased: date, today: date = None, species: str = DEFAULT
+):
+    r"""
+    :return: first fertilization date of a tree of ``species`` bought on
+        ``purchased``; it depends on whether ``today`` is in season.
+    """
+    if today is None:
+        today = date.today()
+    rule = RULES[species]
+    if in_season(today, species):
+        return purchased + timedelta(days=rule.new_tree_days)
+    return add_months(purchased, rule.new_tree_months)
+
+
+def _add_months_array(days, months):
+    r"""
+    Vectorized :func:`add_months` for ``datetime64[D]`` arrays.
+    """
+    import numpy as np
+
+    month_start = days.astype("datetime64[M]")
+    day_offset = days - month_start.astype("datetime64[D]")
+    target = month_start + months
+    month_length = (target + 1).astype("datetime64[D]") - target.astype(
+        "datetime64[D]"
+    )
+    return target.astype("datetime64[D]") + np.minimum(
+        day_offset, month_length - 1
+    )
+
+
+def next_fertilize_array(today: date, last_repot, species: str = DEFAULT):
+    r"""
+    Applies :func:`next_fertilize` to an array of repot dates of trees of
+    ``species``.
+
+    :param last_repot: day ordinals, None for trees never repotted.
+    :return: ``datetime64[D]`` array of the next fertilization dates.
+    """
+    # numpy is only needed for batch planning, keep it off the startup path
+    import numpy as np
+
+    nat = np.iinfo(np.int64).min
+    repot = np.array(
+        [nat if day is None else day - _EPOCH for day in last_repot],
+        dtype=np.int64,
+    ).view("datetime64[D]")
+
+    # today is the same for every tree, so the seasonal rule is scalar
+    base = np.datetime64(next_fertilize(today, species=species), "D")
+    blocked = _add_months_array(repot, RULES[species].repot_block_months)
+
+    # NaT compares False, so trees never repotted keep the base date
+    return np.where(blocked > base, blocked, base)
+
+
+def recompute_fertilize(trees, today: date = None, species=None):
+    r"""
+    Recomputes the next fertilization date of all trees, or of the trees of
+    the species in ``species`` only, in one vectorized pass per species and
+    sets it through ``bonsai.set_next_fertilize``, so changed trees are marked
+    dirty.
+
+    :return: list of the trees whose date changed.
+    """
+    if today is None:
+        today = date.today()
+
+    groups = {}
+    for tree in trees:
+        tree_species = species_of(tree.name)
+        if species is None or tree_species in species:
+            groups.setdefault(tree_species, []).append(tree)
+
+    changed = []
+    for tree_species, group in groups.items():
+        repot = [
+            None if tree.last_repot is None else tree.last_repot.toordinal()
+            for tree in group
+        ]
+        result = next_fertilize_array(today, repot, tree_species)
+        result = result.astype("int64") + _EPOCH
+        for tree, ordinal in zip(group, result.tolist()):
+            if tree.set_next_fertilize(date.fromordinal(ordinal)):
+                changed.append(tree)
+    return changed
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Author: Viktor Pfaffenrot
+
+
+Stress run of concurrent writers. Several processes open connections of their
+own to one database and save random trees in a loop, the way several
+instances of the app or scripts would. Saves are compare-and-swap, so a
+writer whose trees were saved by another one meanwhile gets a conflict
+instead of overwriting them. Afterwards it is checked that no two successful
+saves were based on the same version of a tree, which would mean one of them
+overwrote the other, that every tree has one history row per version without
+gaps and that the number of rows matches the number of successful saves.
+Beforehand it is checked that a save after deleting the tree saved last gets
+a new history id, so readers following the history notice it.
+
+.. code-block:: bash
+
+    python bonsai_stress.py --processes 8 --seconds 10 --trees 20
+"""
+
+from datetime import date, timedelta
+import bonsai_database as bonsai_db
+import multiprocessing
+import tempfile
+import argparse
+import sqlite3
+import random
+import time
+import sys
+import os
+
+
+def _writer(db_file: str, seconds: float, seed: int, results: object):
+    r"""
+    Loads the trees, changes one to three of them and saves them until
+    ``seconds`` are over. Puts the counts of saves, rows written, conflicts
+    and "database is locked" errors to ``results``, together with the
+    ``(treeid, version)`` every written tree was based on.
+    """
+    from bonsai_class import bonsai, bonsai_record
+
+    rng = random.Random(seed)
+    conn = bonsai_db.create_connection(db_file)
+    counts = {"saves": 0, "rows": 0, "conflicts": 0, "locked": 0}
+    bases = []
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        loaded = bonsai_db.load_database(conn, versions=True)
+        records = [
+            bonsai_record(*row[1:], bonsai_db.MAIN, row[0])
+            for row in rng.sample(loaded, rng.randint(1, 3))
+        ]
+        records = [
+            record._replace(
+                last_pruning=date(2020, 1, 1)
+                + timedelta(days=rng.randrange(1500))
+            )
+            for record in records
+        ]
+        time.sleep(rng.random() / 1000)  # widen the window for conflicts
+        try:
+            rows, _ = bonsai.save_records(conn, records)
+        except bonsai_db.version_conflict:
+            counts["conflicts"] += 1
+        except sqlite3.OperationalError as e:
+            if "locked" not in str(e):
+                raise
+            counts["locked"] += 1
+        else:
+            counts["saves"] += 1
+            counts["rows"] += rows
+            bases.extend((record.treeid, record.version) for record in records)
+    conn.close()
+    results.put((counts, bases))
+
+
+def check(conn):
+    r"""
+    :return: list of the treeids whose versions do not match their history:
+        a version missing or stored twice, or ``bonsai_current`` not holding
+        the newest one.
+    """
+    return [
+        treeid
+        for (treeid,) in conn.execute(
+            """SELECT treeid FROM bonsai GROUP BY treeid
+            HAVING COUNT(*) != MAX(version)
+            OR COUNT(DISTINCT version) != COUNT(*)
+            OR MAX(version) != (SELECT version FROM bonsai_current
+                WHERE bonsai_current.treeid = bonsai.treeid)"""
+        )
+    ]
+
+
+def check_delete_then_save(conn):
+    r"""
+    Saves a tree, deletes it again and saves another one, the way a user
+    deleting the tree saved last and adding a new one does.
+
+    :return: True if the new tree is returned by
+        ``bonsai_database.load_changed`` for the history seen before the
+        delete, i.e. readers following the history notice it.
+    """
+    from bonsai_class import bonsai_record
+
+    def record(treeid, name):
+        return bonsai_record(
+            treeid, name, None, None, None, None, bonsai_db.MAIN, None
+        )
+
+    treeid = conn.execute(
+        "SELECT IFNULL(MAX(treeid) + 1, 0) FROM bonsai"
+    ).fetchone()[0]
+    bonsai_db.add_records(conn, [record(treeid, "Deleted")])
+    seen = conn.execute("SELECT MAX(histid) FROM bonsai").fetchone()[0]
+    bonsai_db.remove_record(conn, record(treeid, "Deleted"))
+    bonsai_db.add_records(conn, [record(treeid + 1, "Saved after")])
+    changed = bonsai_db.load_changed(conn, seen)
+    bonsai_db.remove_record(conn, record(treeid + 1, "Saved after"))
+    return [row[1] for row in changed] == [treeid + 1]
+
+
+def stress(db_file: str, processes: int = 8, seconds: float = 5.0):
+    r"""
+    Runs ``processes`` writers on ``db_file`` for ``seconds``.
+
+    :return: dictionary of the summed counts of the writers, the rows
+        found in the database, the number of saves based on a version another
+        save was based on as well and the trees failing :func:`check`.
+    """
+    conn = bonsai_db.create_connection(db_file)
+    rows_before = conn.execute("SELECT COUNT(*) FROM bonsai").fetchone()[0]
+
+    results = multiprocessing.Queue()
+    writers = [
+        multiprocessing.Process(
+            target=_writer, args=(db_file, seconds, seed, results)
+        )
+        for seed in range(processes)
+    ]
+    for writer in writers:
+        writer.start()
+    counts, bases = zip(*[results.get() for _ in writers])
+    for writer in writers:
+        writer.join()
+
+    total = {key: sum(c[key] for c in counts) for key in counts[0]}
+    rows_after = conn.execute("SELECT COUNT(*) FROM bonsai").fetchone()[0]
+    total["rows_found"] = rows_after - rows_before
+    bases = [base for writer_bases in bases for base in writer_bases]
+    total["overwritten"] = len(bases) - len(set(bases))
+    total["broken_trees"] = check(conn)
+    conn.close()
+    return total
+
+
+# ------------------------------------------------------------------------------
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--processes", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument(
+        "--trees",
+        type=int,
+        default=20,
+        help="trees in the database, fewer trees cause more conflicts",
+    )
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_file = os.path.join(directory, "stress.db")
+        conn = bonsai_db.create_connection(db_file)
+        bonsai_db.initialize_table(conn)
+        count = conn.execute("SELECT COUNT(*) FROM bonsai_current").fetchone()
+        bonsai_db.import_records(
+            conn,
+            (
+                (None, f"Tree {ii}", None, None, None, None)
+                for ii in range(max(args.trees - count[0], 0))
+            ),
+        )
+        reused = not check_delete_then_save(conn)
+        conn.close()
+
+        result = stress(db_file, args.processes, args.seconds)
+
+    print(
+        f"{result['saves']} saves of {result['rows']} rows,"
+        f" {result['conflicts']} conflicts,"
+        f" {result['locked']} locked errors"
+    )
+    print(
+        f"{result['rows_found']} rows found in the database,"
+        f" {result['overwritten']} saves overwrote another one"
+    )
+    consistent = (
+        result["rows_found"] == result["rows"]
+        and not result["overwritten"]
+        and not result["broken_trees"]
+        and not reused
+    )
+    if reused:
+        print("a save after a delete reused a history id already seen")
+    if result["broken_trees"]:
+        print(f"versions out of order: trees {result['broken_trees']}")
+    return 0 if consistent else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
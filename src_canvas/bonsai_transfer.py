@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Author: Viktor Pfaffenrot
+
+
+Bulk import and export of tree inventories as CSV or JSON. Both directions
+stream: files are read row by row and written to the database in chunks,
+exports are written while the rows are fetched. Memory use therefore does
+not depend on the size of the inventory.
+
+Files have the columns ``treeid``, ``name``, ``next_fertilize``,
+``last_pruning``, ``last_repot`` and ``last_wiring``; dates are written as
+"dd.mm.YYYY" or "Not Yet" like in the app. History exports start with the
+``histid`` and the ``saved_at`` unix time of every row. JSON files hold an
+array of objects, one per line; JSON lines files are read as well.
+"""
+
+from bonsai_dates import format_date, parse_date
+import bonsai_database as bonsai_db
+import json
+import csv
+import sys
+
+#: columns of an inventory file
+FIELDS = ("treeid", "name") + bonsai_db.DATE_COLUMNS
+#: columns of a history export
+HISTORY_FIELDS = ("histid", "saved_at") + FIELDS
+
+_FORMATS = {".csv": "csv", ".json": "json", ".jsonl": "json"}
+
+
+def file_format(path: str, fmt: str = None):
+    r"""
+    :return: ``fmt`` or the format belonging to the extension of ``path``.
+    """
+    if fmt is not None:
+        return fmt
+    for extension, name in _FORMATS.items():
+        if path.lower().endswith(extension):
+            return name
+    raise ValueError(f"cannot tell the format of '{path}', give csv or json")
+
+
+# -----------------------------------READING------------------------------------
+def read_csv(file):
+    r"""
+    :return: generator of the rows of a CSV file with header as dictionaries.
+    """
+    yield from csv.DictReader(file)
+
+
+def read_json(file, block: int = 1 << 16):
+    r"""
+    Reads the objects of a JSON array or of JSON lines one by one. The file is
+    read in blocks of ``block`` characters.
+
+    :return: generator of the objects.
+    """
+    decoder = json.JSONDecoder()
+    buffer, pos, eof = "", 0, False
+    while True:
+        # skip the brackets of the array and the commas between objects
+        while pos < len(buffer) and buffer[pos] in " \t\r\n[],":
+            pos += 1
+        if pos == len(buffer):
+            if eof:
+                return
+            buffer, pos = file.read(block), 0
+            eof = not buffer
+            continue
+        try:
+            value, pos = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            # the object may continue in the next block
+            more = "" if eof else file.read(block)
+            if not more:
+                raise
+            buffer, pos = buffer[pos:] + more, 0
+            continue
+        yield value
+
+
+def _date(value):
+    return None if value is None else parse_date(str(value))
+
+
+def to_record(row: dict):
+    r"""
+    Converts a row of a file into a record for
+    ``bonsai_database.import_records``. Dates follow the rules of
+    ``bonsai_dates.parse_date``.
+
+    :raises ValueError: if the row is no valid tree.
+    """
+    if not isinstance(row, dict):
+        raise ValueError("a row has to be an object")
+    name = str(row.get("name") or "").strip()
+    if not name:
+        raise ValueError("the name is missing")
+    treeid = row.get("treeid")
+    treeid = None if treeid in (None, "") else int(treeid)
+    return (treeid, name) + tuple(
+        _date(row.get(column)) for column in bonsai_db.DATE_COLUMNS
+    )
+
+
+def validate(rows, errors=None):
+    r"""
+    Converts rows into records. Invalid rows are skipped and reported to
+    ``errors(number, message)``; rows are numbered from 1.
+
+    :return: generator of records.
+    """
+    for number, row in enumerate(rows, 1):
+        try:
+            yield to_record(row)
+        except (ValueError, TypeError) as e:
+            if errors is not None:
+                errors(number, str(e))
+
+
+def import_file(
+    conn,
+    file,
+    fmt: str,
+    keep_ids: bool = False,
+    chunk_size: int = 5000,
+    errors=None,
+    renumbered=None,
+):
+    r"""
+    Imports the trees of an open CSV or JSON file. See
+    ``bonsai_database.import_records`` for ``keep_ids``, ``chunk_size`` and
+    ``renumbered``.
+
+    :return: tuple of the number of trees written and of rows skipped.
+    """
+    skipped = 0
+
+    def skip(number, message):
+        nonlocal skipped
+        skipped += 1
+        if errors is not None:
+            errors(number, message)
+
+    rows = read_csv(file) if fmt == "csv" else read_json(file)
+    written = bonsai_db.import_records(
+        conn,
+        validate(rows, skip),
+        chunk_size=chunk_size,
+        keep_ids=keep_ids,
+        renumbered=renumbered,
+    )
+    return written, skipped
+
+
+# -----------------------------------WRITING------------------------------------
+def _values(record: tuple):
+    return tuple(
+        format_date(value) if ii >= len(record) - 4 else value
+        for ii, value in enumerate(record)
+    )
+
+
+def export_file(conn, file, fmt: str, history: bool = False):
+    r"""
+    Writes the latest state of all trees, or with ``history`` all saved
+    versions, to an open file.
+
+    :return: number of rows written.
+    """
+    fields = HISTORY_FIELDS if history else FIELDS
+    records = bonsai_db.iter_records(conn, history=history)
+    count = 0
+    if fmt == "csv":
+        writer = csv.writer(file)
+        writer.writerow(fields)
+        for record in records:
+            writer.writerow(_values(record))
+            count += 1
+        return count
+
+    file.write("[")
+    for record in records:
+        separator = ",\n" if count else "\n"
+        file.write(separator + json.dumps(dict(zip(fields, _values(record)))))
+        count += 1
+    file.write("\n]\n")
+    return count
+
+
+def print_error(number: int, message: str):
+    print(f"row {number} skipped: {message}", file=sys.stderr)
+
+
+def print_renumbered(treeid: int, new_treeid: int):
+    print(
+        f"treeid {treeid} belongs to a stored tree, imported as {new_treeid}",
+        file=sys.stderr,
+    )
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Author: Viktor Pfaffenrot
+
+
+Background I/O of the app. All database and file work is queued to one
+worker thread, so a slow disk does not freeze the window. Results are handed
+back to the Tk main loop, which picks them up every ``poll_ms`` milliseconds
+with ``after`` while work is in flight; Tk itself is only ever touched from
+the main thread.
+"""
+
+import tkinter as tk
+import threading
+import queue
+import sys
+
+
+class io_worker:
+    r"""
+    A single background thread working through a queue of jobs in the order
+    they were submitted. ``done`` and ``error`` callbacks run in the Tk main
+    loop of ``master``.
+
+    .. code-block:: python
+
+        worker = io_worker(root)
+        worker.submit(bonsai_db.load_database, conn, done=show_trees)
+        ...
+        worker.close()
+
+    .. automethod:: submit
+    .. automethod:: close
+    """
+
+    def __init__(self, master: object, poll_ms: int = 16):
+        self.master = master
+        self.poll_ms = poll_ms  #: ~60 polls per second while busy
+        self.pending = 0  #: jobs submitted but not handed back yet
+        self._requests = queue.Queue()
+        self._results = queue.Queue()
+        self._after = None
+        self._thread = threading.Thread(
+            target=self._run, name="bonsai-io", daemon=True
+        )
+        self._thread.start()
+
+    def submit(self, func, *args, done=None, error=None):
+        r"""
+        Queues ``func(*args)``. Its return value is passed to ``done``, an
+        exception to ``error``; exceptions without ``error`` callback are
+        printed.
+        """
+        self.pending += 1
+        self._requests.put((func, args, done, error))
+        if self._after is None:
+            self._after = self.master.after(self.poll_ms, self._poll)
+
+    def _run(self):
+        while True:
+            job = self._requests.get()
+            if job is None:
+                break
+            func, args, done, error = job
+            try:
+                result = (done, func(*args))
+            except Exception as e:
+                result = (error, e)
+                if error is None:
+                    print(f"{func.__name__} failed: {e!r}", file=sys.stderr)
+            self._results.put(result)
+
+    def _poll(self):
+        self._after = None
+        while True:
+            try:
+                callback, value = self._results.get_nowait()
+            except queue.Empty:
+                break
+            self.pending -= 1
+            if callback is not None:
+                callback(value)
+        if self.pending:
+            self._after = self.master.after(self.poll_ms, self._poll)
+
+    def close(self):
+        r"""
+        Finishes the queued jobs and stops the thread. Callbacks of jobs that
+        finish now are dropped, the window is gone at this point.
+        """
+        if self._after is not None:
+            try:
+                self.master.after_cancel(self._after)
+            except tk.TclError:  # the window is already destroyed
+                pass
+            self._after = None
+        self._requests.put(None)
+        self._thread.join()